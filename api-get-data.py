@@ -1,4 +1,7 @@
-import requests
+import asyncio
+import json
+import queue
+import threading
 import sqlite3
 import pandas as pd
 import configparser
@@ -6,6 +9,19 @@ import time
 import numpy as np
 import matplotlib.pyplot as plt
 
+from estat_aggregates import build_parent_maps, refresh_aggregates
+from estat_client import get_client
+from estat_hash import (
+    block_hashes,
+    combine_hashes,
+    diff_hashes,
+    frame_row_hashes,
+    load_hashes,
+    save_hashes,
+)
+from estat_shared_cache import bump_generation, current_generation
+from estat_time import get_time_dim, map_time_codes, save_time_dim
+
 # -------------------------------
 # 2. APIパラメータの設定
 # -------------------------------
@@ -19,6 +35,10 @@ stats_idS = {
 }
 chosen_stat = 1
 
+# パイプライン設定（取得→整形→DB書き込みを並行実行）
+queue_size = 4  # ステージ間キューの上限（背圧）
+write_batch_rows = 5000  # DB書き込みスレッドのコミット単位（行数）
+
 # 追加の絞り込みがあれば extra_paramsを設定
 EXTRA = {
     "cdCat01": "110",
@@ -42,14 +62,74 @@ cat01_list = []
 cat02_list = []
 df_summary = pd.DataFrame()
 df_values = pd.DataFrame()
-df_transformed = pd.DataFrame()
-df_pivoted = pd.DataFrame()
 
 
 # -------------------------------
 # 自作関数
 # -------------------------------
-def fetch_estat_paged(
+def _page_values(js):
+    """レスポンスの DATA_INF.VALUE を list に正規化"""
+    values = js["GET_STATS_DATA"]["STATISTICAL_DATA"]["DATA_INF"].get("VALUE", [])
+    if isinstance(values, dict):
+        values = [values]
+    return values
+
+
+# -------------------------------
+# メタ情報（CLASS_INF / TABLE_INF）キャッシュ
+# -------------------------------
+META_CACHE_TABLE = "estat_meta_cache"
+
+
+def _updated_date(table_info):
+    return str((table_info or {}).get("UPDATED_DATE", ""))
+
+
+def _ensure_meta_cache_table(conn):
+    conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS {META_CACHE_TABLE} (
+            stats_data_id TEXT, updated_date TEXT, table_inf TEXT, class_inf TEXT,
+            PRIMARY KEY (stats_data_id, updated_date))"""
+    )
+
+
+def load_meta_cache(db_path, stats_data_id):
+    """
+    statsDataId の最新のメタ情報キャッシュを返す。無ければ None。
+    戻り値: {"UPDATED_DATE": str, "TABLE_INF": dict, "CLASS_INF": dict}
+    """
+    with sqlite3.connect(db_path) as conn:
+        _ensure_meta_cache_table(conn)
+        row = conn.execute(
+            f"SELECT updated_date, table_inf, class_inf FROM {META_CACHE_TABLE} "
+            "WHERE stats_data_id = ? ORDER BY updated_date DESC LIMIT 1",
+            (str(stats_data_id),),
+        ).fetchone()
+    if row is None:
+        return None
+    return {
+        "UPDATED_DATE": row[0],
+        "TABLE_INF": json.loads(row[1]),
+        "CLASS_INF": json.loads(row[2]),
+    }
+
+
+def save_meta_cache(db_path, stats_data_id, table_info, class_info):
+    """statsDataId + UPDATED_DATE をキーにメタ情報を保存（同一キーは上書き）"""
+    with sqlite3.connect(db_path) as conn:
+        _ensure_meta_cache_table(conn)
+        conn.execute(
+            f"INSERT OR REPLACE INTO {META_CACHE_TABLE} VALUES (?, ?, ?, ?)",
+            (
+                str(stats_data_id),
+                _updated_date(table_info),
+                json.dumps(table_info, ensure_ascii=False),
+                json.dumps(class_info, ensure_ascii=False),
+            ),
+        )
+
+
+def iter_estat_pages(
     URL,
     API_KEY,
     stats_data_id,
@@ -57,18 +137,23 @@ def fetch_estat_paged(
     max_total=None,
     extra_params=None,
     sleep_sec=0.2,
+    cached_meta=None,
+    client=None,
 ):
     """
-    e-Stat getStatsData をページングで取得する。
+    e-Stat getStatsData をページ単位で取得し、レスポンス dict を1ページずつ yield する。
     - page_size : 1回のAPI取得件数（>=100000 はAPI仕様上不可）
     - max_total : 総取得上限。None の場合は全件取得。
-    戻り値: 最初のレスポンス構造を踏襲した dict（...DATA_INF.VALUE が全ページ連結）
+    - cached_meta : load_meta_cache() の戻り値。指定時は1ページ目から metaGetFlg=N で取得し、
+                    UPDATED_DATE が一致すればキャッシュの CLASS_INF を1ページ目に差し込む。
+    - client : estat_client.EstatClient（省略時はプロセス共通のクライアント）
+    メタ情報は statsDataId ごとに1回だけ取得し、2ページ目以降は常に metaGetFlg=N。
     """
+    client = client or get_client()
     params_base = {"appId": API_KEY, "statsDataId": stats_data_id}
     if extra_params:
         params_base.update(extra_params)
-    first_json = None
-    all_values = []
+    n_fetched = 0
     start_pos = 1
     keep_fetching = True
 
@@ -76,7 +161,7 @@ def fetch_estat_paged(
         if max_total is None:
             limit_this = page_size
         else:
-            remaining = max_total - len(all_values)
+            remaining = max_total - n_fetched
             if remaining <= 0:
                 break
             limit_this = min(page_size, remaining)
@@ -84,17 +169,23 @@ def fetch_estat_paged(
         params = params_base.copy()
         params["startPosition"] = start_pos
         params["limit"] = limit_this
-
-        resp = requests.get(URL, params=params)
-        resp.raise_for_status()
-        js = resp.json()
-
-        if first_json is None:
-            first_json = js
-        values = js["GET_STATS_DATA"]["STATISTICAL_DATA"]["DATA_INF"].get("VALUE", [])
-        if isinstance(values, dict):
-            values = [values]
-        all_values.extend(values)
+        is_first = n_fetched == 0 and start_pos == 1
+        params["metaGetFlg"] = "Y" if (is_first and cached_meta is None) else "N"
+
+        js = client.get_json(URL, params=params)
+
+        if is_first and cached_meta is not None:
+            stat_data = js["GET_STATS_DATA"]["STATISTICAL_DATA"]
+            table_info = stat_data.get("TABLE_INF")
+            if table_info and _updated_date(table_info) == cached_meta["UPDATED_DATE"]:
+                stat_data["CLASS_INF"] = cached_meta["CLASS_INF"]
+            else:
+                # 統計表が更新されている → このページだけメタ情報付きで取り直す
+                params["metaGetFlg"] = "Y"
+                js = client.get_json(URL, params=params)
+
+        values = _page_values(js)
+        n_fetched += len(values)
         ri = js["GET_STATS_DATA"]["STATISTICAL_DATA"]["RESULT_INF"]
         total = int(ri.get("TOTAL_NUMBER", 0))
         to_num = int(ri.get("TO_NUMBER", 0))
@@ -102,10 +193,61 @@ def fetch_estat_paged(
             keep_fetching = False
         else:
             start_pos = to_num + 1
-        if (max_total is not None) and (len(all_values) >= max_total):
+        if (max_total is not None) and (n_fetched >= max_total):
             keep_fetching = False
 
-        time.sleep(sleep_sec)
+        yield js
+        if keep_fetching:
+            time.sleep(sleep_sec)
+
+
+async def fetch_estat_pages_async(URL, API_KEY, stats_data_id, **kwargs):
+    """
+    iter_estat_pages の非同期版。HTTP待ちをワーカースレッドに逃がし、
+    取得済みページを1件ずつ yield する（待ちの間も後段の整形・書き込みは進む）。
+    """
+    pages = iter_estat_pages(URL, API_KEY, stats_data_id, **kwargs)
+    while True:
+        js = await asyncio.to_thread(next, pages, None)
+        if js is None:
+            break
+        yield js
+
+
+def fetch_estat_paged(
+    URL,
+    API_KEY,
+    stats_data_id,
+    page_size=2000,
+    max_total=None,
+    extra_params=None,
+    sleep_sec=0.2,
+    cached_meta=None,
+    client=None,
+):
+    """
+    e-Stat getStatsData をページングで取得する。
+    - page_size : 1回のAPI取得件数（>=100000 はAPI仕様上不可）
+    - max_total : 総取得上限。None の場合は全件取得。
+    - cached_meta, client : iter_estat_pages を参照
+    戻り値: 最初のレスポンス構造を踏襲した dict（...DATA_INF.VALUE が全ページ連結）
+    """
+    first_json = None
+    all_values = []
+    for js in iter_estat_pages(
+        URL,
+        API_KEY,
+        stats_data_id,
+        page_size=page_size,
+        max_total=max_total,
+        extra_params=extra_params,
+        sleep_sec=sleep_sec,
+        cached_meta=cached_meta,
+        client=client,
+    ):
+        if first_json is None:
+            first_json = js
+        all_values.extend(_page_values(js))
     if first_json is None:
         raise RuntimeError("APIからデータを取得できませんでした。")
 
@@ -159,34 +301,306 @@ def detect_cat_axes(maps, max_cat=10):
     return axes
 
 
-def build_col_key_from_row(row, cat_axes):
+def build_col_keys(df, cat_axes):
     """
-    1行の値から列キー 'tab-<code>_cat01-<code>_cat02-<code>...' を生成
+    VALUE の DataFrame から列キー 'tab-<code>_cat01-<code>_cat02-<code>...' を一括生成
     - tab は必須
     - cat_axes に列挙されている cat は、値が空/NaNでなければ採用
     """
 
-    def safe_get(r, col):
-        v = r.get(col, "")
-        if v is None:
-            return ""
-        s = str(v)
-        return "" if s == "nan" else s
-
-    parts = []
-    tab_code = safe_get(row, "@tab")
-    parts.append(f"tab-{tab_code}")
+    def safe_col(col):
+        if col not in df.columns:
+            return pd.Series("", index=df.index)
+        return df[col].fillna("").astype(str).replace("nan", "")
 
+    keys = "tab-" + safe_col("@tab")
     for axis in cat_axes:
-        code = safe_get(row, f"@{axis}")
-        if code != "":
-            parts.append(f"{axis}-{code}")
-    return "_".join(parts)
+        code = safe_col(f"@{axis}")
+        keys = keys.where(code == "", keys + f"_{axis}-" + code)
+    return keys
+
+
+# -------------------------------
+# 取得→整形→DB書き込みパイプライン
+# -------------------------------
+_PIPELINE_END = object()  # キュー終端の目印
+VALUES_TABLE = "estat_values"
+
+
+def transform_page_to_long(values, cat_axes, time_dim):
+    """
+    1ページ分の VALUE(list) を縦持ちブロック (col_key, id, value) に変換。
+    id は時間次元表（estat_time）との結合で決める。月次以外の系列は列キーに
+    '_freq-<Q|H|Y|FQ|FH|FY>' を付け、異なる粒度の系列を同じ表に共存させる。
+    戻り値: (df_long, df_meta_src)  df_meta_src は列メタ作成用の軸コード
+    """
+    df_page = pd.json_normalize(values)
+    for axis in ["tab"] + cat_axes:
+        col = f"@{axis}"
+        if col not in df_page.columns:
+            df_page[col] = ""
+
+    tm = map_time_codes(df_page["@time"], time_dim)
+    known = tm["id"].notna()  # 解釈できない時間コードの値は除外
+    df_page, tm = df_page[known].copy(), tm[known]
+    keys = build_col_keys(df_page, cat_axes)
+    df_page["col_key"] = keys.where(tm["freq"] == "M", keys + "_freq-" + tm["freq"])
+    df_page["id"] = tm["id"]
+    df_page["value"] = pd.to_numeric(df_page["$"], errors="coerce")
+
+    meta_source_cols = ["col_key", "@tab"] + [f"@{a}" for a in cat_axes]
+    df_meta_src = df_page[meta_source_cols].drop_duplicates()
+    return df_page[["col_key", "id", "value"]], df_meta_src
+
+
+def _put_or_abort(q, item, state):
+    """背圧付きで put。後段が異常終了していれば諦める（デッドロック防止）"""
+    while True:
+        if state.get("error") is not None:
+            return False
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+
+
+def _put_end(q, state):
+    """
+    終端の目印を必ず届ける。後段が異常終了してキューが満杯のままなら、
+    残りを読み捨てて空きを作る（後段が止まっていても put で固まらない）
+    """
+    while True:
+        try:
+            q.put(_PIPELINE_END, timeout=0.5)
+            return
+        except queue.Full:
+            if state.get("error") is None:
+                continue
+            try:
+                while True:
+                    q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def _drain_to_end(q):
+    """異常終了後も終端まで読み捨て、前段の put を詰まらせない"""
+    while q.get() is not _PIPELINE_END:
+        pass
+
+
+def _transform_worker(page_q, block_q, state):
+    """ページ → 縦持ちブロック。最初のページの CLASS_INF から軸情報を確定する"""
+    ended = False
+    try:
+        while True:
+            js = page_q.get()
+            if js is _PIPELINE_END:
+                ended = True
+                break
+            if state.get("error") is not None:
+                continue  # 異常時は終端まで読み捨て
+            stat_data = js["GET_STATS_DATA"]["STATISTICAL_DATA"]
+            if "first_json" not in state:
+                state["first_json"] = js
+                state["maps"] = build_code_name_maps(stat_data["CLASS_INF"])
+                state["cat_axes"] = detect_cat_axes(state["maps"], max_cat=10)
+                state["time_dim"] = get_time_dim(
+                    stat_data["TABLE_INF"]["@id"],
+                    stat_data["TABLE_INF"].get("UPDATED_DATE", ""),
+                    stat_data["CLASS_INF"],
+                )
+            values = _page_values(js)
+            if not values:
+                continue
+            df_long, df_meta_src = transform_page_to_long(
+                values, state["cat_axes"], state["time_dim"]
+            )
+            state["meta_src"].append(df_meta_src)
+            if not _put_or_abort(block_q, df_long, state):
+                continue
+    except Exception as e:  # noqa: BLE001 - メインスレッドで再送出する
+        state["error"] = e
+        if not ended:
+            _drain_to_end(page_q)
+    finally:
+        _put_end(block_q, state)
+
+
+def _q(ident):
+    return '"' + str(ident).replace('"', '""') + '"'
+
+
+def _apply_block(conn, block, known_cols, known_ids):
+    """
+    縦持ちブロックを estat_values に反映する。既存セルと値を比べ、
+    新規・変更のセルだけ書く（欠損値は既存値を残す）。戻り値: 書いたセル (col_key, id)
+    """
+    block = block.dropna(subset=["value"])
+    if block.empty:
+        return block[["col_key", "id"]]
+    cols = [c for c in block["col_key"].unique() if c in known_cols]
+    if cols:
+        old = pd.read_sql_query(
+            f"SELECT id, {', '.join(_q(c) for c in cols)} FROM {VALUES_TABLE} "
+            "WHERE id BETWEEN ? AND ?",
+            conn,
+            params=[block["id"].min(), block["id"].max()],
+        )
+        old["id"] = old["id"].astype(str)
+        old = old.melt(id_vars="id", var_name="col_key", value_name="old")
+        block = block.merge(old, on=["col_key", "id"], how="left")
+        block = block[block["old"].isna() | (block["value"] != block["old"])]
+    if block.empty:
+        return block[["col_key", "id"]]
+
+    for col in block["col_key"].unique():
+        if col not in known_cols:
+            conn.execute(f"ALTER TABLE {VALUES_TABLE} ADD COLUMN {_q(col)} REAL")
+            known_cols.add(col)
+    new_ids = sorted(set(block["id"]) - known_ids)
+    conn.executemany(
+        f"INSERT INTO {VALUES_TABLE} (id) VALUES (?)", [(i,) for i in new_ids]
+    )
+    known_ids.update(new_ids)
+    for col, grp in block.groupby("col_key"):
+        conn.executemany(
+            f"UPDATE {VALUES_TABLE} SET {_q(col)} = ? WHERE id = ?",
+            zip(grp["value"].astype(float), grp["id"]),
+        )
+    return block[["col_key", "id"]]
+
+
+def _db_writer_worker(block_q, db_path, batch_rows, state):
+    """
+    縦持ちブロックを estat_values に直接書き込む唯一のDBライター。
+    取得待ちの間に書き込みを進め、変わったセルだけ書く。batch_rows セルごとにコミット。
+    ブロックごとの内容ハッシュ（estat_hash）と書いたセルは state に集める。
+    """
+    conn = None
+    ended = False
+    try:
+        conn = sqlite3.connect(db_path)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {VALUES_TABLE} (id INTEGER)")
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_estat_values_id ON {VALUES_TABLE} (id)"
+        )
+        known_cols = {
+            r[1] for r in conn.execute(f"PRAGMA table_info({VALUES_TABLE})")
+        } - {"id"}
+        known_ids = {str(r[0]) for r in conn.execute(f"SELECT id FROM {VALUES_TABLE}")}
+        conn.commit()
+        pending = 0
+        while True:
+            block = block_q.get()
+            if block is _PIPELINE_END:
+                ended = True
+                break
+            if state.get("error") is not None:
+                continue
+            state["block_hashes"].append(block_hashes(block))
+            state["col_keys"].update(block["col_key"].unique())
+            written = _apply_block(conn, block, known_cols, known_ids)
+            state["written"].append(written)
+            state["rows_written"] += len(block)
+            pending += len(written)
+            if pending >= batch_rows:
+                conn.commit()
+                pending = 0
+        conn.commit()
+    except Exception as e:  # noqa: BLE001 - メインスレッドで再送出する
+        state["error"] = e
+        if not ended:
+            _drain_to_end(block_q)
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+async def _produce_pages(page_q, state, fetch_kwargs):
+    async for js in fetch_estat_pages_async(**fetch_kwargs):
+        ok = await asyncio.to_thread(_put_or_abort, page_q, js, state)
+        if not ok:
+            break
+
+
+def run_ingest_pipeline(
+    URL,
+    API_KEY,
+    stats_data_id,
+    db_path,
+    page_size=2000,
+    max_total=None,
+    extra_params=None,
+    sleep_sec=0.2,
+    queue_size=4,
+    batch_rows=5000,
+):
+    """
+    非同期取得 → 整形スレッド → DB書き込みスレッド を上限付きキューで連結して実行。
+    値は DB書き込みスレッドが取得と並行して estat_values に直接反映する（変わったセルのみ）。
+    メタ情報は META_CACHE_TABLE のキャッシュを使い、統計表が更新されていれば保存し直す。
+    戻り値: state dict（first_json, maps, cat_axes, meta_src, rows_written, meta_cache_hit,
+    block_hashes: ページごとのブロックハッシュ, col_keys: 取得した系列,
+    written: estat_values に書いたセル (col_key, id) のリスト）
+    """
+    cached_meta = load_meta_cache(db_path, stats_data_id)
+    page_q = queue.Queue(maxsize=queue_size)
+    block_q = queue.Queue(maxsize=queue_size)
+    state = {
+        "error": None,
+        "meta_src": [],
+        "rows_written": 0,
+        "block_hashes": [],
+        "col_keys": set(),
+        "written": [],
+    }
 
+    transformer = threading.Thread(
+        target=_transform_worker, args=(page_q, block_q, state), daemon=True
+    )
+    writer = threading.Thread(
+        target=_db_writer_worker, args=(block_q, db_path, batch_rows, state), daemon=True
+    )
+    transformer.start()
+    writer.start()
+
+    fetch_kwargs = dict(
+        URL=URL,
+        API_KEY=API_KEY,
+        stats_data_id=stats_data_id,
+        page_size=page_size,
+        max_total=max_total,
+        extra_params=extra_params,
+        sleep_sec=sleep_sec,
+        cached_meta=cached_meta,
+    )
+    try:
+        asyncio.run(_produce_pages(page_q, state, fetch_kwargs))
+    except Exception as e:
+        state["error"] = e
+    finally:
+        _put_end(page_q, state)
+        transformer.join()
+        writer.join()
+
+    if state["error"] is not None:
+        raise state["error"]
+    if "first_json" not in state:
+        raise RuntimeError("APIからデータを取得できませんでした。")
 
-def format_time_to_yyyymmdd(t):
-    s = str(t).strip()
-    return s[:4] + s[-2:] + "01"
+    stat_data = state["first_json"]["GET_STATS_DATA"]["STATISTICAL_DATA"]
+    state["meta_cache_hit"] = cached_meta is not None and _updated_date(
+        stat_data["TABLE_INF"]
+    ) == cached_meta["UPDATED_DATE"]
+    if not state["meta_cache_hit"]:
+        save_meta_cache(
+            db_path, stats_data_id, stat_data["TABLE_INF"], stat_data["CLASS_INF"]
+        )
+    with sqlite3.connect(db_path) as conn:
+        save_time_dim(conn, stats_data_id, state["time_dim"])
+    return state
 
 
 # -------------------------------
@@ -211,18 +625,26 @@ stat_id = stats_idS.get(chosen_stat)
 print("APIリクエスト開始。")
 
 
-json_data = fetch_estat_paged(
+pipeline_state = run_ingest_pipeline(
     URL,
     API_KEY,
     stat_id,
+    DB_PATH,
     page_size=page_size,
     max_total=limit_num,
     extra_params=EXTRA,
     sleep_sec=0.2,
+    queue_size=queue_size,
+    batch_rows=write_batch_rows,
 )
+json_data = pipeline_state["first_json"]
 
 
-print("APIリクエスト完了。")
+print(
+    f"APIリクエスト完了。({pipeline_state['rows_written']} 件"
+    f", メタ情報キャッシュ: {'利用' if pipeline_state['meta_cache_hit'] else '更新'})"
+)
+print(get_client().summary())
 
 ###### 3_複数の同時リクエスト（将来的に使用、limit_num=2000以上の処理未対応）
 ###### for key in stats_idS:
@@ -240,8 +662,8 @@ table_info = STATISTICAL_DATA["TABLE_INF"]
 stat_name = table_info["STAT_NAME"]["$"]
 title = table_info["TITLE"]
 
-maps = build_code_name_maps(class_info)
-cat_axes = detect_cat_axes(maps, max_cat=10)  # ['cat01', 'cat02', ...]
+maps = pipeline_state["maps"]
+cat_axes = pipeline_state["cat_axes"]  # ['cat01', 'cat02', ...]
 
 tab_code = ""
 cat01_list, cat02_list = [], []
@@ -278,79 +700,36 @@ df_summary = pd.DataFrame(
 )
 
 # -------------------------------
-# 5. 統計値の整形とピボット処理
+# 5. 統計値の書き込み結果
 # -------------------------------
-data_values = STATISTICAL_DATA["DATA_INF"]["VALUE"]
-df_values = pd.json_normalize(data_values)
-
-for axis in cat_axes:
-    col = f"@{axis}"
-    if col not in df_values.columns:
-        df_values[col] = ""
-
-df_values["$"] = pd.to_numeric(df_values["$"], errors="coerce")
-
-df_values["col_key"] = df_values.apply(
-    lambda r: build_col_key_from_row(r, cat_axes), axis=1
+# estat_values への書き込みは取り込みパイプラインの DBライターが取得と並行して済ませている
+conn = sqlite3.connect(DB_PATH)
+df_written = pd.concat(
+    [pd.DataFrame(columns=["col_key", "id"])] + pipeline_state["written"],
+    ignore_index=True,
 )
 
-
-df_values["id"] = df_values["@time"].apply(format_time_to_yyyymmdd)
-
-df_transformed = df_values[["id", "col_key", "$"]]
-df_pivoted = df_transformed.pivot(index="id", columns="col_key", values="$")
-df_pivoted.reset_index(inplace=True)
-
-df = pd.DataFrame(df_pivoted)
-
-# 確認用 後ほど削除予定
-print(df.head())
-print(df.isna().mean())
+print(f"{len(pipeline_state['col_keys'])} 系列, 書き込み {len(df_written)} セル")
 
 # -------------------------------
 # 6. SQLite保存
 # -------------------------------
-conn = sqlite3.connect(DB_PATH)
 cursor = conn.cursor()
 
-cursor.execute(
-    "SELECT name FROM sqlite_master WHERE type='table' AND name='estat_values'"
+# 変更検知: (系列, 年) ごとの内容ハッシュを前回取り込み分と比べる（スキップ数の集計と
+# 次回比較用。セル単位の差分書き込みは DBライターで実施済み）
+values_hashes, values_skipped = diff_hashes(
+    combine_hashes(pipeline_state["block_hashes"]), load_hashes(conn, "estat_values")
+)
+save_hashes(conn, "estat_values", values_hashes)
+
+# 集計テーブル（estat_agg_*）の差分更新：今回変わった id / 系列のみ
+agg_written = refresh_aggregates(
+    conn,
+    df_written["id"],
+    df_written["col_key"],
+    parent_maps=build_parent_maps(class_info),
 )
-table_exists = cursor.fetchone()
-
-if not table_exists:
-    df_pivoted.to_sql(
-        "estat_values",
-        conn,
-        if_exists="replace",
-        index=False,
-        dtype={col: "REAL" for col in df_pivoted.columns if col != "id"}
-        | {"id": "INTEGER"},
-    )
-else:
-    df_existing = pd.read_sql_query("SELECT * FROM estat_values", conn)
-
-    df_existing.set_index("id", inplace=True)
-    df_new = df_pivoted.set_index("id")
-
-    all_cols = df_existing.columns.union(df_new.columns)
-    df_existing = df_existing.reindex(columns=all_cols)
-    df_new = df_new.reindex(columns=all_cols)
-
-    df_final = df_new.combine_first(df_existing)
-
-    # 整形処理
-    df_final = df_final.reset_index()
-    df_final = df_final.dropna(axis=1, how="all")
-    df_final = df_final.sort_values("id", ascending=False)
-
-    df_final.to_sql(
-        "estat_values",
-        conn,
-        if_exists="replace",
-        index=False,
-        dtype={col: "REAL" for col in df_final.columns if col != "id"},
-    )
 
 # 分類情報テーブルの更新・追加
 cursor.execute(
@@ -358,6 +737,10 @@ cursor.execute(
 )
 class_table_exists = cursor.fetchone()
 
+summary_hashes, summary_skipped = diff_hashes(
+    frame_row_hashes(df_summary, "tab"), load_hashes(conn, "estat_class_info")
+)
+
 if not class_table_exists:
     df_summary.to_sql(
         "estat_class_info",
@@ -366,7 +749,7 @@ if not class_table_exists:
         index=False,
         dtype={col: "text" for col in df_summary if col != "tab"} | {"tab": "INTEGER"},
     )
-else:
+elif not summary_hashes.empty:
     df_existing_tab = pd.read_sql_query("SELECT * FROM estat_class_info", conn)
     df_class_table = pd.concat(
         [df_existing_tab.set_index("tab"), df_summary.set_index("tab")]
@@ -382,7 +765,11 @@ else:
 
 meta_rows = []
 meta_source_cols = ["col_key", "@tab"] + [f"@{a}" for a in cat_axes]
-df_meta_src = df_values[meta_source_cols].drop_duplicates()
+df_meta_src = (
+    pd.concat(pipeline_state["meta_src"], ignore_index=True)
+    .reindex(columns=meta_source_cols)
+    .drop_duplicates()
+)
 
 for _, r in df_meta_src.iterrows():
     rec = {
@@ -397,6 +784,10 @@ for _, r in df_meta_src.iterrows():
     meta_rows.append(rec)
 
 df_colmeta_new = pd.DataFrame(meta_rows)
+save_hashes(conn, "estat_class_info", summary_hashes)
+colmeta_hashes, colmeta_skipped = diff_hashes(
+    frame_row_hashes(df_colmeta_new, "col_key"), load_hashes(conn, "estat_column_meta")
+)
 
 cursor.execute(
     "SELECT name FROM sqlite_master WHERE type='table' AND name='estat_column_meta'"
@@ -412,7 +803,7 @@ if not meta_exists:
     df_colmeta_new.to_sql(
         "estat_column_meta", conn, if_exists="replace", index=False, dtype=dtype_meta
     )
-else:
+elif not colmeta_hashes.empty:
     df_colmeta_old = pd.read_sql_query("SELECT * FROM estat_column_meta", conn)
 
     all_cols_meta = df_colmeta_old.columns.union(df_colmeta_new.columns)
@@ -431,8 +822,27 @@ else:
         dtype={c: "INTEGER" for c in merged.columns},
     )
 
+save_hashes(conn, "estat_column_meta", colmeta_hashes)
+
+# 系列の出所（col_key → statsDataId）。delete_db.py の statsDataId 単位削除で使用
+cursor.execute(
+    "CREATE TABLE IF NOT EXISTS estat_series_source "
+    "(col_key TEXT PRIMARY KEY, stats_data_id TEXT)"
+)
+cursor.executemany(
+    "INSERT OR REPLACE INTO estat_series_source VALUES (?, ?)",
+    [(c, str(stat_id)) for c in sorted(pipeline_state["col_keys"])],
+)
+conn.commit()
+
+# 取り込み世代を進める（共有キャッシュ estat_shared_cache の作り直し判定に使用）
+# 何も変わっていなければ世代は据え置き（キャッシュを作り直さない）
+n_changed = len(df_written) + len(summary_hashes) + len(colmeta_hashes)
+generation = bump_generation(conn) if n_changed else current_generation(conn)
 conn.close()
 
-print("統計値-> 'estat_values'")
-print("分類要約->'estat_class_info'")
-print("列メタは->'estat_column_meta'")
+print(f"統計値-> 'estat_values' (変更なしでスキップ: {values_skipped} ブロック)")
+print(f"分類要約->'estat_class_info' (スキップ: {summary_skipped} ブロック)")
+print(f"列メタは->'estat_column_meta' (スキップ: {colmeta_skipped} ブロック)")
+print(f"集計->'estat_agg_*' {agg_written}")
+print(f"取り込み世代-> {generation}")
@@ -1,17 +1,19 @@
 import json
-import requests
 import sqlite3
 import pandas as pd
 import configparser
 
+from estat_client import get_client
+
 config_ini = configparser.ConfigParser()
 config_ini.read("config.ini", encoding="utf-8")
 API_KEY = config_ini["API"]["KEY"]
 URL = config_ini["API"]["url_list"]
 PARAMS = {"appId": API_KEY, "searchWord": "月次", "surveyYears": 2015, "limit": 15}
 
-response = requests.get(URL, params=PARAMS)
-json_data = response.json()
+client = get_client()
+json_data = client.get_json(URL, params=PARAMS)
+print(client.summary())
 
 # テーブル形式に変換
 table_info = json_data["GET_STATS_LIST"]["DATALIST_INF"]["TABLE_INF"]
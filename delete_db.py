@@ -1,11 +1,411 @@
+import argparse
+import json
+import re
 import sqlite3
+from typing import List, Optional, Set
 
-DB_PATH = "estat_data.db"
+from estat_aggregates import (
+    AGGREGATES,
+    agg_table_name,
+    load_cached_parent_maps,
+    purge_aggregates,
+    refresh_aggregates,
+)
+from estat_hash import invalidate_hashes
+from estat_shared_cache import bump_generation
+from estat_time import TIME_DIM_TABLE
 
-with sqlite3.connect(DB_PATH) as conn:
-    cursor = conn.cursor()
-    # estat_valuesテーブルのデータのみ削除
-    cursor.execute("DELETE FROM estat_values;")
+VALUES_TABLE = "estat_values"
+COLUMN_META_TABLE = "estat_column_meta"
+CLASS_INFO_TABLE = "estat_class_info"
+SOURCE_TABLE = "estat_series_source"
+META_CACHE_TABLE = "estat_meta_cache"
+ADJ_TABLE = "adj-table"
+RUN_META_TABLE = "adj_run_meta"  # tabel-adjster.py --batch-config の出力表の記録
+
+
+def _q(ident: str) -> str:
+    return '"' + str(ident).replace('"', '""') + '"'
+
+
+def _table_exists(conn: sqlite3.Connection, tbl: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (tbl,)
+    ).fetchone()
+    return row is not None
+
+
+def _columns(conn: sqlite3.Connection, tbl: str) -> List[str]:
+    if not _table_exists(conn, tbl):
+        return []
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({_q(tbl)})")]
+
+
+def _adj_tables(conn: sqlite3.Connection) -> List[str]:
+    """adj-table と、バッチ作成（adj_run_meta に記録）された adj 系の出力表"""
+    tables = [ADJ_TABLE]
+    if _table_exists(conn, RUN_META_TABLE):
+        tables += [
+            r[0]
+            for r in conn.execute(f"SELECT DISTINCT tbl FROM {RUN_META_TABLE}")
+            if r[0] not in tables
+        ]
+    return [t for t in tables if _table_exists(conn, t)]
+
+
+def _adj_names(col_keys: Set[str]) -> Set[str]:
+    """adj-table 側の列名（tabel-adjster.py の sanitize_colname と同じ正規化）も含める"""
+    return set(col_keys) | {re.sub(r"[^\w]", "_", c) for c in col_keys}
+
+
+def _shift_months(yyyymmdd: str, months: int) -> str:
+    y, m = int(yyyymmdd[:4]), int(yyyymmdd[4:6])
+    k = y * 12 + (m - 1) + months
+    return f"{k // 12:04d}{k % 12 + 1:02d}01"
+
+
+# ---------- 削除対象の解決 ----------
+
+
+def series_of_stats_id(conn: sqlite3.Connection, stats_data_id: str) -> Set[str]:
+    """statsDataId に属する col_key（estat_series_source に取り込み時に記録されたもの）"""
+    if not _table_exists(conn, SOURCE_TABLE):
+        return set()
+    return {
+        r[0]
+        for r in conn.execute(
+            f"SELECT col_key FROM {SOURCE_TABLE} WHERE stats_data_id = ?",
+            (stats_data_id,),
+        )
+    }
+
+
+def guess_series_of_stats_id(
+    conn: sqlite3.Connection, stats_data_id: str
+) -> Set[str]:
+    """
+    estat_series_source に記録の無い古い列のうち、全軸コードが statsDataId の
+    CLASS_INF（estat_meta_cache）に含まれるものを推定で返す。
+    '100'（合計）など多くの表に共通するコードで他の表の列も一致しうるため、
+    --match-class-inf 指定時のみ使い、--dry-run で一覧を確認してから削除する。
+    """
+    if not _table_exists(conn, META_CACHE_TABLE):
+        return set()
+    known = set()
+    if _table_exists(conn, SOURCE_TABLE):
+        known = {r[0] for r in conn.execute(f"SELECT col_key FROM {SOURCE_TABLE}")}
+
+    codes = {}
+    for (class_inf,) in conn.execute(
+        f"SELECT class_inf FROM {META_CACHE_TABLE} WHERE stats_data_id = ?",
+        (stats_data_id,),
+    ):
+        objs = json.loads(class_inf).get("CLASS_OBJ", [])
+        for obj in [objs] if isinstance(objs, dict) else objs:
+            cl = obj.get("CLASS", [])
+            for c in [cl] if isinstance(cl, dict) else cl:
+                codes.setdefault(obj.get("@id"), set()).add(str(c.get("@code")))
+    found: Set[str] = set()
+    for col in _columns(conn, VALUES_TABLE):
+        if col == "id" or col in known:
+            continue
+        parts = [p.partition("-") for p in col.split("_")]
+        parts = [p for p in parts if p[0] != "freq"]  # 粒度サフィックスは除外
+        if codes and all(code in codes.get(axis, ()) for axis, _, code in parts):
+            found.add(col)
+    return found
+
+
+def _tab_codes(col_keys: Set[str]) -> Set[str]:
+    """col_key（'tab-<code>_cat01-...'）の表章項目コード"""
+    codes = set()
+    for c in col_keys:
+        axis, _, code = c.split("_")[0].partition("-")
+        if axis == "tab" and code:
+            codes.add(code)
+    return codes
+
+
+# ---------- 削除処理 ----------
+
+
+def drop_series(conn: sqlite3.Connection, tbl: str, col_keys: Set[str]) -> int:
+    """
+    列をまとめて削除。DROP COLUMN を列数回行う代わりに、残す列だけで表を1回作り直す。
+    作り直した表にはインデックスを張り直す（削除した列を含むものは除く）。
+    """
+    info = conn.execute(f"PRAGMA table_info({_q(tbl)})").fetchall()
+    keep = [r for r in info if r[1] not in col_keys]
+    if len(keep) == len(info):
+        return 0
+    kept_names = {r[1] for r in keep}
+    indexes = [
+        sql
+        for name, sql in conn.execute(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+            (tbl,),
+        ).fetchall()
+        if all(
+            r[2] in kept_names
+            for r in conn.execute(f"PRAGMA index_info({_q(name)})")
+        )
+    ]
+    tmp = f"_{tbl}_rebuild"
+    cols_ddl = ", ".join(
+        f"{_q(r[1])} {r[2]}" + (" PRIMARY KEY" if r[5] else "") for r in keep
+    )
+    cols = ", ".join(_q(r[1]) for r in keep)
+    conn.execute(f"DROP TABLE IF EXISTS {_q(tmp)}")
+    conn.execute(f"CREATE TABLE {_q(tmp)} ({cols_ddl})")
+    conn.execute(f"INSERT INTO {_q(tmp)} ({cols}) SELECT {cols} FROM {_q(tbl)}")
+    conn.execute(f"DROP TABLE {_q(tbl)}")
+    conn.execute(f"ALTER TABLE {_q(tmp)} RENAME TO {_q(tbl)}")
+    for sql in indexes:
+        conn.execute(sql)
+    return len(info) - len(keep)
+
+
+def delete_range(
+    conn: sqlite3.Connection,
+    tbl: str,
+    start: str,
+    end: str,
+    col_keys: Optional[Set[str]] = None,
+) -> int:
+    """id 範囲の行を削除（col_keys 指定時はその列だけ NULL にする）"""
+    if not _table_exists(conn, tbl):
+        return 0
+    if col_keys is None:
+        cur = conn.execute(
+            f"DELETE FROM {_q(tbl)} WHERE id BETWEEN ? AND ?", (start, end)
+        )
+        return cur.rowcount
+    cols = [c for c in _columns(conn, tbl) if c in col_keys]
+    if not cols:
+        return 0
+    cur = conn.execute(
+        f"UPDATE {_q(tbl)} SET {', '.join(f'{_q(c)} = NULL' for c in cols)} "
+        "WHERE id BETWEEN ? AND ?",
+        (start, end),
+    )
+    return cur.rowcount
+
+
+# ---------- 保守（VACUUM / ANALYZE） ----------
+
+
+def compact(conn: sqlite3.Connection) -> str:
+    """
+    auto_vacuum=INCREMENTAL を有効化（未設定なら初回のみ VACUUM で切り替え）し、
+    空きページを返却する。
+    """
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return "VACUUM（auto_vacuum=INCREMENTAL に切り替え）"
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.execute("PRAGMA incremental_vacuum")
+    return f"incremental_vacuum（{free} ページ返却）"
+
+
+# ---------- CLI & メイン ----------
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        description=(
+            "estat_data.db の範囲削除と保守を行います。"
+            "削除はメタ情報・集計・adj-table にも連動します。"
+        )
+    )
+    p.add_argument(
+        "--sqlite", type=str, default="./estat_data.db", help="SQLite DBファイルパス"
+    )
+
+    # 対象
+    p.add_argument("--stats-id", nargs="*", default=[], help="削除する statsDataId")
+    p.add_argument("--series", nargs="*", default=[], help="削除する col_key")
+    p.add_argument("--from", dest="date_from", type=str, help="削除期間の開始 id (YYYYMMDD)")
+    p.add_argument("--to", dest="date_to", type=str, help="削除期間の終了 id (YYYYMMDD)")
+    p.add_argument(
+        "--retain-months",
+        type=int,
+        default=None,
+        help="最新 id の月を含む直近 N か月だけを残し、それより古い行を削除（ローリング保持）",
+    )
+    p.add_argument(
+        "--match-class-inf",
+        action="store_true",
+        help=(
+            "--stats-id で、出所の記録が無い古い列も CLASS_INF のコード一致で推定して"
+            "対象に含める（他の表の列も一致しうるため --dry-run で確認すること）"
+        ),
+    )
+    p.add_argument(
+        "--all",
+        action="store_true",
+        help="estat_values の全データと、連動する adj-table・集計・メタ情報を削除",
+    )
+
+    # 保守
+    p.add_argument("--no-vacuum", action="store_true", help="VACUUM を行わない")
+    p.add_argument("--no-analyze", action="store_true", help="ANALYZE を行わない")
+    p.add_argument(
+        "--dry-run", action="store_true", help="削除対象を表示するだけで変更しない"
+    )
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.sqlite)
+
+    # 1) 対象系列
+    col_keys: Set[str] = set(args.series)
+    guessed: Set[str] = set()
+    for sid in args.stats_id:
+        col_keys |= series_of_stats_id(conn, sid)
+        guessed |= guess_series_of_stats_id(conn, sid)
+    guessed -= col_keys
+    if args.match_class_inf:
+        col_keys |= guessed
+    elif guessed:
+        print(
+            f"出所の記録が無い列 {len(guessed)} 列は対象外です"
+            "（--match-class-inf --dry-run で推定結果を確認できます）"
+        )
+    value_cols = set(_columns(conn, VALUES_TABLE)) - {"id"}
+
+    # 2) 対象期間
+    start, end = args.date_from, args.date_to
+    if args.retain_months is not None and _table_exists(conn, VALUES_TABLE):
+        max_id = conn.execute(f"SELECT MAX(id) FROM {VALUES_TABLE}").fetchone()[0]
+        if max_id is not None:
+            start = "00000000"
+            # 最新月を含めて N か月を残す（cutoff = 残す最古の月の1日、その前日まで削除）
+            cutoff = _shift_months(str(max_id), -(args.retain_months - 1))
+            end = f"{int(cutoff) - 1:08d}"
+    if (start is None) != (end is None):
+        start = start or "00000000"
+        end = end or "99999999"
+    has_range = start is not None
+
+    if has_range:
+        print(f"対象系列: {len(col_keys)} 列, 対象期間: {start}〜{end}")
+    else:
+        print(f"対象系列: {len(col_keys)} 列")
+    if args.dry_run:
+        for c in sorted(col_keys):
+            print(f"  {c}" + ("  (CLASS_INF から推定)" if c in guessed else ""))
+        conn.close()
+        return
+
+    parent_maps = load_cached_parent_maps(conn)
+    summary = []
+
+    if args.all:
+        # 値と、値に紐づくメタ情報（列メタ・分類要約・出所・メタキャッシュ・時間次元）
+        adj_tables = _adj_tables(conn)
+        for tbl in (
+            VALUES_TABLE,
+            *adj_tables,
+            COLUMN_META_TABLE,
+            CLASS_INFO_TABLE,
+            SOURCE_TABLE,
+            META_CACHE_TABLE,
+            TIME_DIM_TABLE,
+        ):
+            if _table_exists(conn, tbl):
+                conn.execute(f"DELETE FROM {_q(tbl)}")
+        for name in AGGREGATES:
+            conn.execute(f"DROP TABLE IF EXISTS {_q(agg_table_name(name))}")
+        for tbl in (VALUES_TABLE, *adj_tables, COLUMN_META_TABLE, CLASS_INFO_TABLE):
+            invalidate_hashes(conn, tbl)
+        summary.append(
+            f"estat_values / {', '.join(adj_tables) or 'adj-table'} / 集計 / メタ情報を全削除"
+        )
+
+    elif has_range:
+        # 期間削除（系列指定があればその列だけ）
+        scope = col_keys if (args.series or args.stats_id) else None
+        ids = []
+        if _table_exists(conn, VALUES_TABLE):
+            ids = [
+                str(r[0])
+                for r in conn.execute(
+                    f"SELECT id FROM {VALUES_TABLE} WHERE id BETWEEN ? AND ?",
+                    (start, end),
+                )
+            ]
+        n = delete_range(conn, VALUES_TABLE, start, end, scope)
+        adj_scope = None if scope is None else _adj_names(scope)
+        years = (int(start[:4]), int(end[:4]))
+        invalidate_hashes(conn, VALUES_TABLE, scope, year_range=years)
+        n_adj = 0
+        for tbl in _adj_tables(conn):
+            n_adj += delete_range(conn, tbl, start, end, adj_scope)
+            invalidate_hashes(conn, tbl, adj_scope, years)
+        conn.commit()
+        refresh_aggregates(
+            conn,
+            ids,
+            scope if scope is not None else value_cols,
+            parent_maps=parent_maps,
+        )
+        summary.append(f"{VALUES_TABLE}: {n} 行, adj 系: {n_adj} 行")
+
+    elif col_keys:
+        # 系列削除 → 列メタ・出所・adj-table・集計へ連動
+        n = drop_series(conn, VALUES_TABLE, col_keys)
+        for tbl in _adj_tables(conn):
+            drop_series(conn, tbl, _adj_names(col_keys))
+            invalidate_hashes(conn, tbl, _adj_names(col_keys))
+        for tbl in (COLUMN_META_TABLE, SOURCE_TABLE):
+            if _table_exists(conn, tbl):
+                conn.executemany(
+                    f"DELETE FROM {tbl} WHERE col_key = ?", [(c,) for c in col_keys]
+                )
+        invalidate_hashes(conn, VALUES_TABLE, col_keys)
+        invalidate_hashes(conn, COLUMN_META_TABLE, col_keys)
+        conn.commit()
+        purge_aggregates(conn, col_keys, parent_maps=parent_maps)
+        summary.append(f"{VALUES_TABLE}: {n} 列")
+
+    # statsDataId 単位のメタ情報
+    if args.stats_id and not has_range and not args.all:
+        # 分類要約は表章項目（tab）単位。同じ調査名の他の表を巻き込まないよう、
+        # 削除した系列の tab のうち、残った列が使っていないものだけ消す
+        remaining = set(_columns(conn, VALUES_TABLE)) - {"id"}
+        tabs = _tab_codes(col_keys) - _tab_codes(remaining)
+        if tabs and _table_exists(conn, CLASS_INFO_TABLE):
+            conn.executemany(
+                f"DELETE FROM {CLASS_INFO_TABLE} WHERE tab = ?", [(t,) for t in tabs]
+            )
+        invalidate_hashes(conn, CLASS_INFO_TABLE, tabs)
+    for sid in args.stats_id:
+        if has_range or args.all:
+            break
+        for tbl in (META_CACHE_TABLE, TIME_DIM_TABLE):
+            if _table_exists(conn, tbl):
+                conn.execute(f"DELETE FROM {tbl} WHERE stats_data_id = ?", (sid,))
+        summary.append(f"statsDataId={sid} のメタ情報")
     conn.commit()
+    if args.all or has_range or col_keys:
+        bump_generation(conn)  # 共有キャッシュを無効化
+
+    # 3) 保守
+    if not args.no_vacuum:
+        summary.append(compact(conn))
+    if not args.no_analyze:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        summary.append("ANALYZE")
+    conn.close()
+
+    print("[DONE] " + " / ".join(summary) if summary else "[DONE] 変更なし")
+
 
-print("estat_valuesテーブルのデータを削除しました。")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,499 @@
+import argparse
+import json
+import sqlite3
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# ---------- 集計定義 ----------
+# name -> 定義。テーブル名は "estat_agg_<name>"。
+# kind:
+#   period : 年/四半期ごとの集計（freq: 'year' | 'quarter', how: 'mean' | 'sum'）
+#   change : 前年同月比(yoy)・前月比(mom)（%）
+#   parent : CLASS_INF の @parentCode による親分類への集計（axis, how）
+AGGREGATES: Dict[str, dict] = {
+    "year": {"kind": "period", "freq": "year", "how": "mean"},
+    "quarter": {"kind": "period", "freq": "quarter", "how": "mean"},
+    "change": {"kind": "change"},
+    "cat01_parent": {"kind": "parent", "axis": "cat01", "how": "sum"},
+}
+
+SOURCE_TABLE = "estat_values"
+
+_SCHEMAS = {
+    "period": "col_key TEXT, period INTEGER, value REAL, n INTEGER, "
+    "PRIMARY KEY (col_key, period)",
+    "change": "col_key TEXT, id TEXT, yoy REAL, mom REAL, PRIMARY KEY (col_key, id)",
+    "parent": "col_key TEXT, id TEXT, value REAL, n INTEGER, PRIMARY KEY (col_key, id)",
+}
+_RANGE_COL = {"period": "period", "change": "id", "parent": "id"}
+
+
+def agg_table_name(name: str) -> str:
+    return f"estat_agg_{name}"
+
+
+def _q(ident: str) -> str:
+    return '"' + str(ident).replace('"', '""') + '"'
+
+
+def _table_exists(conn: sqlite3.Connection, tbl: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (tbl,)
+    ).fetchone()
+    return row is not None
+
+
+def ensure_aggregate_tables(
+    conn: sqlite3.Connection,
+    parent_maps: Optional[Dict[str, Dict[str, str]]] = None,
+    backfill: bool = True,
+) -> List[str]:
+    """
+    宣言済みの集計テーブル（主キー=索引付き）を作成し、新たに作成した集計名を返す。
+    backfill=True なら、作成したテーブルを既存の estat_values 全体から埋める
+    （取り込みは更新したブロックしか再計算しないため、導入前の系列が欠けないように）。
+    """
+    created = []
+    for name, spec in AGGREGATES.items():
+        tbl = agg_table_name(name)
+        if not _table_exists(conn, tbl):
+            created.append(name)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {_q(tbl)} ({_SCHEMAS[spec['kind']]}) WITHOUT ROWID"
+        )
+        rcol = _RANGE_COL[spec["kind"]]
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {_q(f'ix_{tbl}_{rcol}')} ON {_q(tbl)} ({rcol})"
+        )
+    if created and backfill and _table_exists(conn, SOURCE_TABLE):
+        ids = [r[0] for r in conn.execute(f"SELECT id FROM {_q(SOURCE_TABLE)}")]
+        _refresh(conn, ids, _source_columns(conn), parent_maps, created)
+    return created
+
+
+# ---------- 元データの読み込み ----------
+
+
+def _source_columns(conn: sqlite3.Connection) -> List[str]:
+    rows = conn.execute(f"PRAGMA table_info({_q(SOURCE_TABLE)})").fetchall()
+    return [r[1] for r in rows if r[1] != "id"]
+
+
+def _read_long(
+    conn: sqlite3.Connection,
+    col_keys: Iterable[str],
+    start_id: Optional[str] = None,
+    end_id: Optional[str] = None,
+) -> pd.DataFrame:
+    """estat_values から指定列・期間だけを縦持ち (col_key, id, value) で読む"""
+    col_keys = list(col_keys)
+    if not col_keys:
+        return pd.DataFrame(columns=["col_key", "id", "value"])
+    sql = f"SELECT id, {', '.join(_q(c) for c in col_keys)} FROM {_q(SOURCE_TABLE)}"
+    params: list = []
+    if start_id is not None and end_id is not None:
+        sql += " WHERE id BETWEEN ? AND ?"
+        params = [start_id, end_id]
+    wide = pd.read_sql_query(sql, conn, params=params)
+    wide["id"] = wide["id"].astype(str)
+    long = wide.melt(id_vars="id", var_name="col_key", value_name="value")
+    return long.dropna(subset=["value"])[["col_key", "id", "value"]]
+
+
+def _add_calendar(long: pd.DataFrame) -> pd.DataFrame:
+    ids = long["id"].astype(str)
+    long = long.assign(
+        year=pd.to_numeric(ids.str[:4], errors="coerce"),
+        month=pd.to_numeric(ids.str[4:6], errors="coerce"),
+    )
+    long = long[long["month"].between(1, 12)]  # 不正な id（月=00 など）は除外
+    return long.dropna(subset=["year"]).astype({"year": int, "month": int})
+
+
+def _shift_month_ids(ids: Iterable[str], months: int) -> List[str]:
+    out = []
+    for s in ids:
+        s = str(s)
+        y, m = int(s[:4]), int(s[4:6])
+        k = y * 12 + (m - 1) + months
+        out.append(f"{k // 12:04d}{k % 12 + 1:02d}{s[6:8] or '01'}")
+    return out
+
+
+# ---------- 集計計算 ----------
+
+
+def _periods_of_ids(ids: Iterable[str], spec: dict) -> List[int]:
+    periods = set()
+    for s in ids:
+        y, m = int(s[:4]), int(s[4:6])
+        periods.add(y * 10 + (m - 1) // 3 + 1 if spec["freq"] == "quarter" else y)
+    return sorted(periods)
+
+
+def _compute_period(long: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    long = _add_calendar(long)
+    if spec["freq"] == "quarter":
+        long["period"] = long["year"] * 10 + (long["month"] - 1) // 3 + 1
+    else:
+        long["period"] = long["year"]
+    out = (
+        long.groupby(["col_key", "period"])["value"]
+        .agg(value=spec["how"], n="count")
+        .reset_index()
+    )
+    return out[["col_key", "period", "value", "n"]]
+
+
+def _compute_change(long: pd.DataFrame) -> pd.DataFrame:
+    long = _add_calendar(long)
+    long["k"] = long["year"] * 12 + long["month"] - 1
+    base = long[["col_key", "k", "value"]].drop_duplicates(["col_key", "k"], keep="last")
+
+    def _pct(lag: int) -> pd.Series:
+        prev = base.assign(k=base["k"] + lag).rename(columns={"value": "prev"})
+        merged = long[["col_key", "k"]].merge(prev, on=["col_key", "k"], how="left")
+        ratio = long["value"].to_numpy() / merged["prev"].replace(0, np.nan).to_numpy()
+        return (ratio - 1.0) * 100.0
+
+    return pd.DataFrame(
+        {
+            "col_key": long["col_key"].to_numpy(),
+            "id": long["id"].to_numpy(),
+            "yoy": _pct(12),
+            "mom": _pct(1),
+        }
+    )
+
+
+def build_parent_maps(class_info: dict) -> Dict[str, Dict[str, str]]:
+    """CLASS_INF から 軸ごとの {code: parentCode} マップを作成"""
+    maps: Dict[str, Dict[str, str]] = {}
+    class_objs = class_info.get("CLASS_OBJ", [])
+    if isinstance(class_objs, dict):
+        class_objs = [class_objs]
+    for obj in class_objs:
+        cl = obj.get("CLASS", [])
+        if isinstance(cl, dict):
+            cl = [cl]
+        parents = {
+            str(c.get("@code", "")): str(c["@parentCode"])
+            for c in cl
+            if c.get("@parentCode")
+        }
+        if parents and obj.get("@id"):
+            maps[obj["@id"]] = parents
+    return maps
+
+
+def load_cached_parent_maps(conn: sqlite3.Connection) -> Dict[str, Dict[str, str]]:
+    """estat_meta_cache に保存済みの全 CLASS_INF から親分類マップを合成"""
+    if not _table_exists(conn, "estat_meta_cache"):
+        return {}
+    maps: Dict[str, Dict[str, str]] = {}
+    for (class_inf,) in conn.execute("SELECT class_inf FROM estat_meta_cache"):
+        for axis, parents in build_parent_maps(json.loads(class_inf)).items():
+            maps.setdefault(axis, {}).update(parents)
+    return maps
+
+
+def _parent_key(col_key: str, axis: str, parent_map: Dict[str, str]) -> Optional[str]:
+    """'tab-100_cat01-120_...' の axis コードを親コードに置き換えた列キー"""
+    parts = col_key.split("_")
+    for i, part in enumerate(parts):
+        a, _, code = part.partition("-")
+        if a == axis:
+            parent = parent_map.get(code)
+            if parent is None:
+                return None
+            parts[i] = f"{axis}-{parent}"
+            return "_".join(parts)
+    return None
+
+
+def _children_by_parent(
+    col_keys: Iterable[str], axis: str, parent_map: Dict[str, str]
+) -> Dict[str, List[str]]:
+    children: Dict[str, List[str]] = {}
+    for c in col_keys:
+        p = _parent_key(c, axis, parent_map)
+        if p is not None:
+            children.setdefault(p, []).append(c)
+    return children
+
+
+def _compute_parent(
+    long: pd.DataFrame, spec: dict, children: Dict[str, List[str]]
+) -> pd.DataFrame:
+    child_to_parent = {c: p for p, cs in children.items() for c in cs}
+    long = long.assign(col_key=long["col_key"].map(child_to_parent)).dropna(
+        subset=["col_key"]
+    )
+    out = (
+        long.groupby(["col_key", "id"])["value"]
+        .agg(value=spec["how"], n="count")
+        .reset_index()
+    )
+    return out[["col_key", "id", "value", "n"]]
+
+
+# ---------- 差分リフレッシュ ----------
+
+
+def _replace_rows(
+    conn: sqlite3.Connection,
+    tbl: str,
+    key_col: str,
+    keys: Iterable,
+    col_keys: Iterable[str],
+    df: pd.DataFrame,
+) -> None:
+    """(col_key, key_col) が対象範囲の行を削除し、再計算結果を挿入"""
+    keys = list(keys)
+    col_keys = list(col_keys)
+    if keys and col_keys:
+        conn.executemany(
+            f"DELETE FROM {_q(tbl)} WHERE col_key = ? AND {key_col} = ?",
+            [(c, k) for c in col_keys for k in keys],
+        )
+    if not df.empty:
+        cols = list(df.columns)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {_q(tbl)} ({', '.join(cols)}) "
+            f"VALUES ({', '.join('?' * len(cols))})",
+            df.astype(object).where(df.notna(), None).itertuples(index=False, name=None),
+        )
+
+
+def refresh_aggregates(
+    conn: sqlite3.Connection,
+    touched_ids: Iterable,
+    touched_cols: Iterable[str],
+    parent_maps: Optional[Dict[str, Dict[str, str]]] = None,
+) -> Dict[str, int]:
+    """
+    取り込みで更新された id / 系列(col_key) に関係する集計行だけを再計算する。
+    parent_maps は build_parent_maps() の戻り値（無ければ parent 集計はスキップ）。
+    戻り値: {集計名: 書き込んだ行数}
+    """
+    created = ensure_aggregate_tables(conn, backfill=False)
+    written: Dict[str, int] = {}
+    if created:  # 新規作成した集計は estat_values 全体から埋める
+        ids = [r[0] for r in conn.execute(f"SELECT id FROM {_q(SOURCE_TABLE)}")]
+        written = _refresh(conn, ids, _source_columns(conn), parent_maps, created)
+    names = [n for n in AGGREGATES if n not in created]
+    written.update(_refresh(conn, touched_ids, touched_cols, parent_maps, names))
+    return written
+
+
+def _refresh(
+    conn: sqlite3.Connection,
+    touched_ids: Iterable,
+    touched_cols: Iterable[str],
+    parent_maps: Optional[Dict[str, Dict[str, str]]],
+    names: Iterable[str],
+) -> Dict[str, int]:
+    """refresh_aggregates の本体（集計 names だけを対象にする）"""
+    ids = sorted({str(i) for i in touched_ids})
+    cols = [c for c in dict.fromkeys(touched_cols) if c != "id"]
+    written: Dict[str, int] = {}
+    if not ids or not cols:
+        return written
+
+    all_cols = _source_columns(conn)
+    cols = [c for c in cols if c in all_cols]
+    years = sorted({int(i[:4]) for i in ids})
+
+    for name in names:
+        spec = AGGREGATES[name]
+        tbl = agg_table_name(name)
+        kind = spec["kind"]
+        if kind == "period":
+            # 影響する年の範囲だけ読み直し、該当期間を置き換え
+            long = pd.concat(
+                [_read_long(conn, cols, f"{y}0101", f"{y}1231") for y in years]
+            )
+            df = _compute_period(long, spec)
+            _replace_rows(conn, tbl, "period", _periods_of_ids(ids, spec), cols, df)
+        elif kind == "change":
+            # 当月・翌月(mom)・12か月後(yoy) が影響を受ける
+            affected = set(ids) | set(_shift_month_ids(ids, 1))
+            affected |= set(_shift_month_ids(ids, 12))
+            long = _read_long(conn, cols, min(_shift_month_ids(ids, -12)), max(affected))
+            df = _compute_change(long)
+            df = df[df["id"].isin(affected)]
+            _replace_rows(conn, tbl, "id", sorted(affected), cols, df)
+        elif kind == "parent":
+            pmap = (parent_maps or {}).get(spec["axis"])
+            if not pmap:
+                continue
+            touched_parents = {
+                p for p in (_parent_key(c, spec["axis"], pmap) for c in cols) if p
+            }
+            children = {
+                p: cs
+                for p, cs in _children_by_parent(all_cols, spec["axis"], pmap).items()
+                if p in touched_parents
+            }
+            members = sorted({c for cs in children.values() for c in cs})
+            long = _read_long(conn, members, ids[0], ids[-1])
+            long = long[long["id"].isin(ids)]
+            df = _compute_parent(long, spec, children)
+            _replace_rows(conn, tbl, "id", ids, list(children), df)
+        written[name] = len(df)
+    conn.commit()
+    return written
+
+
+def purge_aggregates(
+    conn: sqlite3.Connection,
+    col_keys: Iterable[str],
+    parent_maps: Optional[Dict[str, Dict[str, str]]] = None,
+) -> None:
+    """
+    削除された系列の集計行を消し、その系列を子に持つ親分類集計を残りの子から再計算する。
+    （estat_values から列を落とした後に呼ぶ）
+    """
+    col_keys = list(col_keys)
+    ensure_aggregate_tables(conn, parent_maps)
+    for name, spec in AGGREGATES.items():
+        tbl = agg_table_name(name)
+        conn.executemany(
+            f"DELETE FROM {_q(tbl)} WHERE col_key = ?", [(c,) for c in col_keys]
+        )
+        pmap = (parent_maps or {}).get(spec.get("axis", ""))
+        if spec["kind"] != "parent" or not pmap:
+            continue
+        parents = {p for p in (_parent_key(c, spec["axis"], pmap) for c in col_keys) if p}
+        conn.executemany(
+            f"DELETE FROM {_q(tbl)} WHERE col_key = ?", [(p,) for p in parents]
+        )
+        children = {
+            p: cs
+            for p, cs in _children_by_parent(
+                _source_columns(conn), spec["axis"], pmap
+            ).items()
+            if p in parents
+        }
+        members = sorted({c for cs in children.values() for c in cs})
+        df = _compute_parent(_read_long(conn, members), spec, children)
+        _replace_rows(conn, tbl, "id", [], [], df)
+    conn.commit()
+
+
+def rebuild_aggregates(
+    conn: sqlite3.Connection,
+    parent_maps: Optional[Dict[str, Dict[str, str]]] = None,
+) -> Dict[str, int]:
+    """estat_values 全体から集計テーブルを作り直す"""
+    ensure_aggregate_tables(conn, backfill=False)
+    for name in AGGREGATES:
+        conn.execute(f"DELETE FROM {_q(agg_table_name(name))}")
+    ids = [r[0] for r in conn.execute(f"SELECT id FROM {_q(SOURCE_TABLE)}")]
+    return _refresh(conn, ids, _source_columns(conn), parent_maps, list(AGGREGATES))
+
+
+# ---------- 照会 API ----------
+
+
+def query_aggregate(
+    conn: sqlite3.Connection,
+    name: str,
+    col_keys: Optional[List[str]] = None,
+    start=None,
+    end=None,
+    parent_maps: Optional[Dict[str, Dict[str, str]]] = None,
+) -> pd.DataFrame:
+    """
+    集計 name を (col_key, 期間) の縦持ちで返す。
+    集計テーブルにある系列はそこから索引で引き、テーブルが無い・まだ計算されていない
+    系列だけ estat_values から都度計算する。
+    start/end は period 集計では period（例: 2024, 20241）、それ以外は id（YYYYMMDD）。
+    """
+    spec = AGGREGATES[name]
+    tbl = agg_table_name(name)
+    rcol = _RANGE_COL[spec["kind"]]
+
+    all_cols = _source_columns(conn) if _table_exists(conn, SOURCE_TABLE) else []
+    if spec["kind"] == "parent":
+        pmap = (parent_maps or {}).get(spec["axis"], {})
+        children = _children_by_parent(all_cols, spec["axis"], pmap)
+        wanted = [p for p in (col_keys or children) if p in children]
+    else:
+        children = {}
+        wanted = [c for c in (col_keys or all_cols) if c in all_cols]
+
+    parts = []
+    if _table_exists(conn, tbl):
+        sql = f"SELECT * FROM {_q(tbl)} WHERE 1=1"
+        params: list = []
+        if col_keys:
+            sql += f" AND col_key IN ({', '.join('?' * len(col_keys))})"
+            params += list(col_keys)
+        if start is not None:
+            sql += f" AND {rcol} >= ?"
+            params.append(start)
+        if end is not None:
+            sql += f" AND {rcol} <= ?"
+            params.append(end)
+        df = pd.read_sql_query(sql, conn, params=params)
+        parts.append(df)
+        # 集計テーブルに1行も無い系列（未作成・未計算）だけを元表から補う
+        present = {
+            r[0] for r in conn.execute(f"SELECT DISTINCT col_key FROM {_q(tbl)}")
+        }
+        wanted = [c for c in wanted if c not in present]
+
+    # フォールバック: 元表から計算（保存はしない）
+    if wanted:
+        if spec["kind"] == "period":
+            df = _compute_period(_read_long(conn, wanted), spec)
+        elif spec["kind"] == "change":
+            df = _compute_change(_read_long(conn, wanted))
+        else:
+            children = {p: children[p] for p in wanted}
+            members = sorted({c for cs in children.values() for c in cs})
+            df = _compute_parent(_read_long(conn, members), spec, children)
+        cast = int if rcol == "period" else str
+        if start is not None:
+            df = df[df[rcol] >= cast(start)]
+        if end is not None:
+            df = df[df[rcol] <= cast(end)]
+        parts.append(df)
+
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame(columns=_schema_columns(spec["kind"]))
+    df = pd.concat(parts, ignore_index=True)
+    return df.sort_values(["col_key", rcol]).reset_index(drop=True)
+
+
+def _schema_columns(kind: str) -> List[str]:
+    cols = _SCHEMAS[kind].split(", PRIMARY KEY")[0]
+    return [c.split()[0] for c in cols.split(", ")]
+
+
+# ---------- CLI ----------
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        description="estat_values から集計テーブル（estat_agg_*）を再構築します。"
+    )
+    p.add_argument(
+        "--sqlite", type=str, default="./estat_data.db", help="SQLite DBファイルパス"
+    )
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    with sqlite3.connect(args.sqlite) as conn:
+        written = rebuild_aggregates(conn, load_cached_parent_maps(conn))
+    print(f"[DONE] 集計テーブルを再構築しました。 {written}")
+
+
+if __name__ == "__main__":
+    main()
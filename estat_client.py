@@ -0,0 +1,124 @@
+import configparser
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ---------- e-Stat API 共通クライアント ----------
+# 全スクリプトの e-Stat 呼び出しをここに集約する。
+#   - requests.Session による接続プール（TCP/TLS を再利用する HTTP keep-alive）
+#   - Accept-Encoding を明示（gzip/deflate）
+#   - 接続/読み取りタイムアウト、5xx・429 の再試行
+#   - リクエストごとの所要時間・サイズの記録（metrics / summary()）
+# 設定は config.ini の [HTTP] セクション（無ければ既定値）。
+
+DEFAULT_HTTP = {
+    "connect_timeout": 5.0,
+    "read_timeout": 60.0,
+    "pool_maxsize": 4,
+    "retries": 3,
+    "accept_encoding": "gzip, deflate",
+}
+
+
+class EstatClient:
+    def __init__(
+        self,
+        connect_timeout: float = DEFAULT_HTTP["connect_timeout"],
+        read_timeout: float = DEFAULT_HTTP["read_timeout"],
+        pool_maxsize: int = DEFAULT_HTTP["pool_maxsize"],
+        retries: int = DEFAULT_HTTP["retries"],
+        accept_encoding: str = DEFAULT_HTTP["accept_encoding"],
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"Accept-Encoding": accept_encoding, "Connection": "keep-alive"}
+        )
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.metrics: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def get(self, url: str, params: Optional[dict] = None) -> requests.Response:
+        """GET して所要時間とサイズを記録。HTTPエラーは例外にする"""
+        t0 = time.perf_counter()
+        resp = self.session.get(url, params=params, timeout=self.timeout)
+        elapsed = time.perf_counter() - t0
+        resp.raise_for_status()
+        wire = resp.headers.get("Content-Length")
+        with self._lock:
+            self.metrics.append(
+                {
+                    "url": url,
+                    "status": resp.status_code,
+                    "elapsed_sec": elapsed,
+                    "wire_bytes": int(wire) if wire else None,
+                    "body_bytes": len(resp.content),
+                    "encoding": resp.headers.get("Content-Encoding", ""),
+                }
+            )
+        return resp
+
+    def get_json(self, url: str, params: Optional[dict] = None) -> dict:
+        return self.get(url, params=params).json()
+
+    def summary(self) -> str:
+        """記録したリクエストの集計（件数・合計/平均時間・転送量）"""
+        with self._lock:
+            m = list(self.metrics)
+        if not m:
+            return "HTTP: 0 件"
+        total = sum(r["elapsed_sec"] for r in m)
+        body = sum(r["body_bytes"] for r in m)
+        wire = sum(r["wire_bytes"] or r["body_bytes"] for r in m)
+        return (
+            f"HTTP: {len(m)} 件, 合計 {total:.2f}s (平均 {total / len(m) * 1000:.0f}ms)"
+            f", 転送 {wire / 1024:.1f}KiB / 展開後 {body / 1024:.1f}KiB"
+        )
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_CLIENT: Optional[EstatClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def client_from_config(path: str = "config.ini") -> EstatClient:
+    """config.ini の [HTTP] セクションからクライアントを作成"""
+    config_ini = configparser.ConfigParser()
+    config_ini.read(path, encoding="utf-8")
+    sec = config_ini["HTTP"] if config_ini.has_section("HTTP") else {}
+
+    def opt(key):
+        return sec.get(key, DEFAULT_HTTP[key])
+
+    return EstatClient(
+        connect_timeout=float(opt("connect_timeout")),
+        read_timeout=float(opt("read_timeout")),
+        pool_maxsize=int(opt("pool_maxsize")),
+        retries=int(opt("retries")),
+        accept_encoding=opt("accept_encoding"),
+    )
+
+
+def get_client() -> EstatClient:
+    """プロセス共通のクライアント（初回呼び出し時に config.ini から作成）"""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = client_from_config()
+        return _CLIENT
@@ -0,0 +1,155 @@
+import sqlite3
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ---------- 変更検知ハッシュ ----------
+# 書き込み単位（ブロック）ごとに内容ハッシュを持ち、前回と同じブロックは書き込みを省く。
+#   値表（estat_values / adj-table）: (col_key, 年) ごと + 系列全体（year=0）
+#   小さな表（estat_class_info / estat_column_meta）: キー列の値ごと（year=0）
+# ハッシュは行ハッシュ（pandas の hash_pandas_object）の XOR で、行の順序に依存しない。
+# 取り込み側が送ってきた内容のハッシュを保存するため、delete_db.py で削除した範囲は
+# invalidate_hashes() で消しておく（次回取り込みで必ず書き直される）。
+
+HASH_TABLE = "estat_block_hash"
+SERIES_YEAR = 0  # year=0 は系列全体 / 表の1行単位のブロック
+
+
+def _ensure_hash_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS {HASH_TABLE} (
+            tbl TEXT, col_key TEXT, year INTEGER, hash INTEGER,
+            PRIMARY KEY (tbl, col_key, year)) WITHOUT ROWID"""
+    )
+
+
+def _xor_by(keys: pd.DataFrame, h: np.ndarray) -> pd.DataFrame:
+    """keys の組ごとに行ハッシュ h を XOR で畳み込む（ソート + reduceat）"""
+    if len(keys) == 0:
+        return keys.assign(hash=np.array([], dtype=np.int64))
+    codes = keys.groupby(list(keys.columns), sort=True).ngroup().to_numpy()
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    folded = np.bitwise_xor.reduceat(h[order], starts)
+    out = keys.iloc[order[starts]].reset_index(drop=True)
+    return out.assign(hash=folded.view(np.int64))
+
+
+def block_hashes(
+    long: pd.DataFrame,
+    key_col: str = "col_key",
+    id_col: str = "id",
+    value_col: str = "value",
+) -> pd.DataFrame:
+    """
+    縦持ち (col_key, id, value) から (col_key, year, hash) を計算（ベクトル化）。
+    欠損値は「書き込まない値」なので対象外。year=0 の行は系列全体のハッシュ。
+    """
+    long = long.dropna(subset=[value_col])
+    ids = long[id_col].astype(str)
+    rows = pd.DataFrame({"id": ids.to_numpy(), "value": long[value_col].to_numpy()})
+    h = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+    keys = pd.DataFrame(
+        {
+            "col_key": long[key_col].astype(str).to_numpy(),
+            "year": pd.to_numeric(ids.str[:4], errors="coerce")
+            .fillna(-1)
+            .astype(int)
+            .to_numpy(),
+        }
+    )
+    per_year = _xor_by(keys, h)
+    per_series = _xor_by(keys[["col_key"]], h).assign(year=SERIES_YEAR)
+    return pd.concat([per_year, per_series[per_year.columns]], ignore_index=True)
+
+
+def combine_hashes(parts: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    ページごとに計算した block_hashes() を (col_key, year) ごとに XOR で合成する。
+    XOR は結合的なので、全行をまとめて計算した場合と同じハッシュになる。
+    """
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame(
+            {"col_key": [], "year": [], "hash": np.array([], dtype=np.int64)}
+        )
+    allp = pd.concat(parts, ignore_index=True)
+    return _xor_by(allp[["col_key", "year"]], allp["hash"].to_numpy(dtype=np.int64))
+
+
+def frame_row_hashes(df: pd.DataFrame, key_col: str) -> pd.DataFrame:
+    """表の1行（key_col の値）ごとのハッシュ。列順・DB由来の型の違いに影響されない"""
+    cols = sorted(df.columns)
+    norm = df[cols].astype(str)
+    h = pd.util.hash_pandas_object(norm, index=False).to_numpy()
+    keys = pd.DataFrame({"col_key": df[key_col].astype(str).to_numpy()})
+    return _xor_by(keys, h).assign(year=SERIES_YEAR)[["col_key", "year", "hash"]]
+
+
+def load_hashes(conn: sqlite3.Connection, tbl: str) -> pd.DataFrame:
+    _ensure_hash_table(conn)
+    return pd.read_sql_query(
+        f"SELECT col_key, year, hash FROM {HASH_TABLE} WHERE tbl = ?",
+        conn,
+        params=[tbl],
+    )
+
+
+def diff_hashes(new: pd.DataFrame, old: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+    """
+    新旧ハッシュを比べ、変わったブロックと変わらなかったブロック数を返す。
+    値表では (col_key, 年) 単位、それ以外は year=0 の行単位で数える。
+    """
+    old = old.astype({"hash": "Int64"})  # 欠損を持てる整数型（float 化で桁落ちさせない）
+    merged = new.merge(
+        old, on=["col_key", "year"], how="left", suffixes=("", "_old")
+    )
+    changed_mask = (
+        merged["hash_old"].isna() | (merged["hash"] != merged["hash_old"]).fillna(True)
+    ).astype(bool)
+    changed = merged.loc[changed_mask, ["col_key", "year", "hash"]]
+    blocks = merged["year"] != SERIES_YEAR
+    if not blocks.any():
+        blocks = ~blocks
+    n_skipped = int((~changed_mask & blocks).sum())
+    return changed.reset_index(drop=True), n_skipped
+
+
+def save_hashes(conn: sqlite3.Connection, tbl: str, hashes: pd.DataFrame) -> None:
+    _ensure_hash_table(conn)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {HASH_TABLE} (tbl, col_key, year, hash) "
+        "VALUES (?, ?, ?, ?)",
+        [
+            (tbl, c, int(y), int(h))
+            for c, y, h in hashes[["col_key", "year", "hash"]].itertuples(
+                index=False, name=None
+            )
+        ],
+    )
+
+
+def invalidate_hashes(
+    conn: sqlite3.Connection,
+    tbl: str,
+    col_keys: Optional[Iterable[str]] = None,
+    year_range: Optional[Tuple[int, int]] = None,
+) -> None:
+    """
+    ハッシュを削除して次回の書き込みを強制する。
+    col_keys / year_range (開始年, 終了年) 指定時はその範囲（と系列全体 year=0）だけ。
+    """
+    _ensure_hash_table(conn)
+    sql = f"DELETE FROM {HASH_TABLE} WHERE tbl = ?"
+    params: list = [tbl]
+    if col_keys is not None:
+        col_keys = list(col_keys)
+        sql += f" AND col_key IN ({', '.join('?' * len(col_keys))})"
+        params += col_keys
+    if year_range is not None:
+        sql += f" AND (year BETWEEN ? AND ? OR year = {SERIES_YEAR})"
+        params += [int(year_range[0]), int(year_range[1])]
+    conn.execute(sql, params)
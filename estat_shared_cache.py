@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import sqlite3
+import uuid
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+# ---------- 共有読み取りキャッシュ（memory-mapped） ----------
+# estat_values の数値行列（id × 系列）をファイルに書き出し、各プロセスは np.memmap で
+# 読み取り専用に開く。同一ホストの複数プロセスはページキャッシュ上の1つのコピーを共有する。
+#
+#   <cache_dir>/estat_values.<DB識別子>.g<世代>.<dtype>.bin  : 行列本体（C順）
+#   <cache_dir>/estat_values.<DB識別子>.g<世代>.<dtype>.json : ラベル（ids, col_keys, 列メタ, shape）
+#   <cache_dir>/current.<DB識別子>.<dtype>.json              : その DB の最新世代のラベルファイル名
+#   <cache_dir>/current.<dtype>.json                         : 最後に作成したラベルファイル名
+#
+# 世代は estat_generation テーブルのカウンタ。取り込み・削除のたびに bump_generation() で進め、
+# 読み手はキャッシュの世代と DB の世代を比べて古ければ作り直す。
+# DB識別子は同じテーブルに保存する乱数 ID。同じ cache_dir を別の DB や作り直した DB
+# （世代が 1 から数え直される）と共用しても、他の DB の行列を返さない。
+
+GENERATION_TABLE = "estat_generation"
+DEFAULT_CACHE_DIR = "./.estat_cache"
+OPEN_RETRIES = 3
+
+
+def _ensure_generation_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {GENERATION_TABLE} (gen INTEGER, db_uid TEXT)"
+    )
+    cols = [r[1] for r in conn.execute(f"PRAGMA table_info({GENERATION_TABLE})")]
+    if "db_uid" not in cols:  # 識別子導入前の DB
+        conn.execute(f"ALTER TABLE {GENERATION_TABLE} ADD COLUMN db_uid TEXT")
+
+
+def current_generation(conn: sqlite3.Connection) -> int:
+    _ensure_generation_table(conn)
+    row = conn.execute(f"SELECT MAX(gen) FROM {GENERATION_TABLE}").fetchone()
+    return int(row[0] or 0)
+
+
+def db_identity(conn: sqlite3.Connection) -> str:
+    """DB の識別子（初回呼び出し時に作成して estat_generation に保存）"""
+    _ensure_generation_table(conn)
+    row = conn.execute(
+        f"SELECT db_uid FROM {GENERATION_TABLE} WHERE db_uid IS NOT NULL LIMIT 1"
+    ).fetchone()
+    if row:
+        return row[0]
+    uid = uuid.uuid4().hex
+    gen = current_generation(conn)
+    conn.execute(f"DELETE FROM {GENERATION_TABLE}")
+    conn.execute(
+        f"INSERT INTO {GENERATION_TABLE} (gen, db_uid) VALUES (?, ?)", (gen, uid)
+    )
+    conn.commit()
+    return uid
+
+
+def bump_generation(conn: sqlite3.Connection) -> int:
+    """取り込み世代を1つ進める（estat_values を変更した処理の最後に呼ぶ）"""
+    uid = db_identity(conn)
+    gen = current_generation(conn) + 1
+    conn.execute(f"DELETE FROM {GENERATION_TABLE}")
+    conn.execute(
+        f"INSERT INTO {GENERATION_TABLE} (gen, db_uid) VALUES (?, ?)", (gen, uid)
+    )
+    conn.commit()
+    return gen
+
+
+class SharedCache:
+    """
+    memmap した行列とラベルの読み取りビュー。
+    values は読み取り専用の np.memmap（コピーなし）、ids / col_keys は行・列ラベル。
+    """
+
+    def __init__(self, cache_dir: str, label_file: str):
+        with open(os.path.join(cache_dir, label_file), encoding="utf-8") as f:
+            labels = json.load(f)
+        self.generation: int = labels["generation"]
+        self.db_uid: Optional[str] = labels.get("db_uid")
+        self.ids: List[str] = labels["ids"]
+        self.col_keys: List[str] = labels["col_keys"]
+        self.meta = pd.DataFrame(labels["meta"])
+        shape = tuple(labels["shape"])
+        if 0 in shape:
+            self.values = np.empty(shape, dtype=labels["dtype"])
+        else:
+            self.values = np.memmap(
+                os.path.join(cache_dir, labels["data_file"]),
+                dtype=labels["dtype"],
+                mode="r",
+                shape=shape,
+            )
+
+    def column(self, col_key: str) -> np.ndarray:
+        """1系列のビュー（コピーなし、ストライドあり）"""
+        return self.values[:, self.col_keys.index(col_key)]
+
+    def frame(self) -> pd.DataFrame:
+        """id を index に持つ DataFrame（値は memmap を参照）"""
+        return pd.DataFrame(
+            self.values,
+            index=pd.Index(self.ids, name="id"),
+            columns=self.col_keys,
+            copy=False,
+        )
+
+
+def build_shared_cache(
+    db_path: str, cache_dir: str = DEFAULT_CACHE_DIR, dtype: str = "float64"
+) -> str:
+    """
+    estat_values / estat_column_meta からキャッシュを作成し、ラベルファイル名を返す。
+    書き込みは一時ファイル経由で rename するため、読み手が途中状態を見ることはない。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    with sqlite3.connect(db_path) as conn:
+        uid = db_identity(conn)
+        gen = current_generation(conn)
+        df = pd.read_sql_query("SELECT * FROM estat_values ORDER BY id", conn)
+        try:
+            meta = pd.read_sql_query("SELECT * FROM estat_column_meta", conn)
+        except pd.errors.DatabaseError:
+            meta = pd.DataFrame()
+
+    ids = df["id"].astype(str).tolist()
+    col_keys = [c for c in df.columns if c != "id"]
+    matrix = df[col_keys].to_numpy(dtype=dtype)
+
+    dtype_name = np.dtype(dtype).name
+    base = f"estat_values.{uid}.g{gen}.{dtype_name}"
+    data_file, label_file = base + ".bin", base + ".json"
+    suffix = f".tmp{os.getpid()}"
+
+    data_path = os.path.join(cache_dir, data_file)
+    if matrix.size:
+        mm = np.memmap(data_path + suffix, dtype=dtype, mode="w+", shape=matrix.shape)
+        mm[:] = matrix
+        mm.flush()
+        del mm
+        os.replace(data_path + suffix, data_path)
+
+    labels = {
+        "generation": gen,
+        "db_uid": uid,
+        "dtype": dtype_name,
+        "shape": list(matrix.shape),
+        "data_file": data_file,
+        "ids": ids,
+        "col_keys": col_keys,
+        "meta": json.loads(meta.to_json(orient="records", force_ascii=False)),
+    }
+    _write_json(cache_dir, label_file, labels, suffix)
+    # 同時に作成した別プロセスが新しい世代を指していれば、ポインタを巻き戻さない
+    if _pointer_generation(cache_dir, _pointer_file(dtype, uid)) <= gen:
+        _write_json(cache_dir, _pointer_file(dtype, uid), label_file, suffix)
+    _write_json(cache_dir, _pointer_file(dtype), label_file, suffix)
+
+    _remove_old_generations(cache_dir, uid, gen, dtype_name)
+    return label_file
+
+
+def _write_json(cache_dir: str, name: str, obj, suffix: str) -> None:
+    path = os.path.join(cache_dir, name)
+    with open(path + suffix, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(path + suffix, path)
+
+
+def _pointer_file(dtype: str, uid: Optional[str] = None) -> str:
+    if uid is None:
+        return f"current.{np.dtype(dtype).name}.json"
+    return f"current.{uid}.{np.dtype(dtype).name}.json"
+
+
+def _read_pointer(cache_dir: str, pointer: str) -> Optional[str]:
+    path = os.path.join(cache_dir, pointer)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _pointer_generation(cache_dir: str, pointer: str) -> int:
+    """ポインタが指すラベルファイルの世代（無ければ -1）"""
+    label_file = _read_pointer(cache_dir, pointer)
+    if label_file is None:
+        return -1
+    return int(label_file.split(".")[2][1:])
+
+
+def _remove_old_generations(
+    cache_dir: str, uid: str, gen: int, dtype_name: str
+) -> None:
+    """
+    同じ DB の古い世代（gen 未満）のファイルを削除。新しい世代は別プロセスが作成中/使用中
+    なので残す（開いている読み手の memmap は OS 上で有効なまま）
+    """
+    for name in os.listdir(cache_dir):
+        parts = name.split(".")
+        if (
+            len(parts) == 5
+            and parts[0] == "estat_values"
+            and parts[1] == uid
+            and parts[3] == dtype_name
+            and parts[2][1:].isdigit()
+            and int(parts[2][1:]) < gen
+        ):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+
+
+def open_shared_cache(
+    db_path: Optional[str] = None,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    dtype: str = "float64",
+) -> SharedCache:
+    """
+    共有キャッシュを開く。db_path を渡すとその DB（識別子と世代）のキャッシュを開き、
+    古い/未作成なら作り直す。db_path なしは最後に作成したキャッシュを開く。
+    ポインタを読んでから開くまでに別プロセスがファイルを入れ替えた場合は開き直す。
+    """
+    for attempt in range(OPEN_RETRIES):
+        if db_path is not None:
+            with sqlite3.connect(db_path) as conn:
+                uid = db_identity(conn)
+                gen = current_generation(conn)
+            label_file = _read_pointer(cache_dir, _pointer_file(dtype, uid))
+            expected = f"estat_values.{uid}.g{gen}.{np.dtype(dtype).name}.json"
+            if label_file != expected or not os.path.exists(
+                os.path.join(cache_dir, label_file)
+            ):
+                label_file = build_shared_cache(db_path, cache_dir, dtype)
+        else:
+            label_file = _read_pointer(cache_dir, _pointer_file(dtype))
+            if label_file is None:
+                raise FileNotFoundError(f"共有キャッシュがありません: {cache_dir}")
+        try:
+            return SharedCache(cache_dir, label_file)
+        except FileNotFoundError:
+            if attempt == OPEN_RETRIES - 1:
+                raise
+    raise FileNotFoundError(f"共有キャッシュを開けません: {cache_dir}")
+
+
+# ---------- CLI ----------
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        description="estat_values の共有読み取りキャッシュ（memmap）を作成します。"
+    )
+    p.add_argument(
+        "--sqlite", type=str, default="./estat_data.db", help="SQLite DBファイルパス"
+    )
+    p.add_argument(
+        "--cache-dir", type=str, default=DEFAULT_CACHE_DIR, help="キャッシュ出力先"
+    )
+    p.add_argument(
+        "--dtype",
+        type=str,
+        choices=["float64", "float32"],
+        default="float64",
+        help="行列の型（float32 でサイズ半分）",
+    )
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    label_file = build_shared_cache(args.sqlite, args.cache_dir, args.dtype)
+    cache = SharedCache(args.cache_dir, label_file)
+    print(
+        f"[DONE] 共有キャッシュを作成しました。 generation={cache.generation}"
+        f" shape={cache.values.shape} dtype={cache.values.dtype}"
+    )
+
+
+if __name__ == "__main__":
+    main()
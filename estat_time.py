@@ -0,0 +1,258 @@
+import re
+import sqlite3
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import pandas as pd
+
+# ---------- 時間軸（time CLASS_OBJ）の正規化 ----------
+# e-Stat の時間コード（例: 2024000101, 2024000100, 2024000103, 2024100000）を
+# 粒度 freq と整数の期間キー period に正規化する。
+#   freq   : 'M'(月次) | 'Q'(四半期) | 'H'(半期) | 'Y'(暦年)
+#            | 'FQ'(年度四半期) | 'FH'(年度半期) | 'FY'(年度)
+#   period : YYYY*100 + n（M: n=月, Q/FQ: n=四半期, H/FH: n=半期, Y/FY: n=0）
+#            年度系の YYYY は年度（2024年度第4四半期 = 2025年1～3月 → FQ 202404）
+#   id     : 期間の開始日 YYYYMMDD（estat_values の id。年度は4月1日）
+# 10桁コードに開始月・終了月があればコードの構造を名称より優先する。
+# 解釈できない時間コード、他のコードと同じ (freq, period) になるコードは警告を出して
+# 時間次元表の freq/period/id を空にし、その値は取り込まない
+# （1つの変わったコードで統計表全体を取り込めなくしない）。
+
+TIME_DIM_TABLE = "estat_time_dim"
+TIME_DIM_COLUMNS = ["time_code", "name", "freq", "period", "id"]
+
+_PAT_FISCAL_QUARTER = re.compile(r"(\d{4})年度.*?第?([1-4])四半期")
+_PAT_FISCAL_HALF = re.compile(r"(\d{4})年度.*?([上下])半?期")
+_PAT_FISCAL_SPAN = re.compile(r"(\d{4})年度\s*(\d{1,2})月?[～~〜\-－](\d{1,2})月期?")
+_PAT_MONTH = re.compile(r"(\d{4})年(\d{1,2})月$")
+_PAT_SPAN = re.compile(r"(\d{4})年(\d{1,2})月?[～~〜\-－](\d{1,2})月期?")
+_PAT_QUARTER = re.compile(r"(\d{4})年?.*?第?([1-4])四半期")
+_PAT_FISCAL = re.compile(r"(\d{4})年度$")
+_PAT_YEAR = re.compile(r"(\d{4})年$")
+
+# 年度の開始月
+FISCAL_START_MONTH = 4
+
+_TIME_DIM_CACHE: Dict[Tuple[str, str], pd.DataFrame] = {}
+_WARNED_CODES: Set[str] = set()
+
+
+def _from_months(year: int, m_from: int, m_to: int) -> Tuple[str, int]:
+    span = m_to - m_from + 1
+    if span == 1:
+        return "M", year * 100 + m_from
+    if span == 3 and (m_from - 1) % 3 == 0:
+        return "Q", year * 100 + (m_from - 1) // 3 + 1
+    if span == 6 and m_from in (1, 7):
+        return "H", year * 100 + (1 if m_from == 1 else 2)
+    if span == 12 and m_from == 1:
+        return "Y", year * 100
+    raise ValueError(f"未対応の期間です: {year}年{m_from}～{m_to}月")
+
+
+def _from_fiscal_months(year: int, m_from: int, m_to: int) -> Tuple[str, int]:
+    """年度コードの開始月～終了月（年をまたぐ 10～3月 なども可）→ (freq, period)"""
+    span = (m_to - m_from) % 12 + 1
+    offset = (m_from - FISCAL_START_MONTH) % 12
+    if span == 3 and offset % 3 == 0:
+        return "FQ", year * 100 + offset // 3 + 1
+    if span == 6 and offset % 6 == 0:
+        return "FH", year * 100 + offset // 6 + 1
+    if span == 12 and offset == 0:
+        return "FY", year * 100
+    raise ValueError(f"未対応の期間です: {year}年度{m_from}～{m_to}月")
+
+
+def parse_time_code(code: str, name: str = "") -> Tuple[str, int]:
+    """
+    1つの時間コードを (freq, period) に変換。
+    コード（YYYY + 種別2桁 + 開始月2桁 + 終了月2桁）に開始月・終了月が揃っていれば
+    その構造で判定し、それ以外（例: 2024000100）は名称（@name）を優先して、
+    名称で解釈できなければコードの構造で判定する。
+    """
+    name = (name or "").strip()
+    s = str(code).strip()
+    if len(s) == 10 and s.isdigit() and int(s[6:8]) and int(s[8:10]):
+        try:
+            return _from_code(s)
+        except ValueError:
+            pass  # 名称で解釈できればそちらを使う
+
+    # 年度系を先に判定（「2024年度第1四半期」を暦年の四半期と取り違えない）
+    m = _PAT_FISCAL_QUARTER.search(name)
+    if m:
+        return "FQ", int(m.group(1)) * 100 + int(m.group(2))
+    m = _PAT_FISCAL_HALF.search(name)
+    if m:
+        return "FH", int(m.group(1)) * 100 + (1 if m.group(2) == "上" else 2)
+    m = _PAT_FISCAL_SPAN.search(name)
+    if m:
+        return _from_fiscal_months(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    m = _PAT_FISCAL.search(name)
+    if m:
+        return "FY", int(m.group(1)) * 100
+    m = _PAT_MONTH.search(name)
+    if m:
+        return "M", int(m.group(1)) * 100 + int(m.group(2))
+    m = _PAT_SPAN.search(name)
+    if m:
+        return _from_months(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    m = _PAT_QUARTER.search(name)
+    if m:
+        return "Q", int(m.group(1)) * 100 + int(m.group(2))
+    m = _PAT_YEAR.search(name)
+    if m:
+        return "Y", int(m.group(1)) * 100
+
+    if len(s) != 10 or not s.isdigit():
+        raise ValueError(f"時間コードを解釈できません: {code!r} ({name})")
+    return _from_code(s)
+
+
+def _from_code(s: str) -> Tuple[str, int]:
+    """10桁の時間コードの構造から (freq, period) を判定"""
+    year, kind, m_from, m_to = int(s[:4]), s[4:6], int(s[6:8]), int(s[8:10])
+    if kind == "10":
+        if m_from == 0 or m_to == 0:
+            return "FY", year * 100
+        return _from_fiscal_months(year, m_from, m_to)
+    if m_from == 0 and m_to == 0:
+        return "Y", year * 100
+    if m_to == 0 or m_from == 0:  # 例: 2024000100 = 2024年1月
+        return "M", year * 100 + (m_from or m_to)
+    return _from_months(year, m_from, m_to)
+
+
+def period_start_id(freq: str, period: int) -> str:
+    """(freq, period) → 期間開始日 YYYYMMDD"""
+    year, n = divmod(int(period), 100)
+    month = {
+        "M": n,
+        "Q": (n - 1) * 3 + 1,
+        "H": (n - 1) * 6 + 1,
+        "Y": 1,
+        "FQ": FISCAL_START_MONTH + (n - 1) * 3,
+        "FH": FISCAL_START_MONTH + (n - 1) * 6,
+        "FY": FISCAL_START_MONTH,
+    }[freq]
+    year += (month - 1) // 12  # 年度の後半は翌年
+    month = (month - 1) % 12 + 1
+    return f"{year:04d}{month:02d}01"
+
+
+def _time_class_list(class_info: dict) -> list:
+    class_objs = class_info.get("CLASS_OBJ", [])
+    if isinstance(class_objs, dict):
+        class_objs = [class_objs]
+    for obj in class_objs:
+        if obj.get("@id") == "time":
+            cl = obj.get("CLASS", [])
+            return [cl] if isinstance(cl, dict) else cl
+    return []
+
+
+def build_time_dim(
+    class_info: dict, extra_codes: Optional[Iterable[str]] = None
+) -> pd.DataFrame:
+    """
+    CLASS_INF の time 軸から時間次元表を作成（time_code を index に持つ DataFrame）。
+    extra_codes は CLASS_INF に無いコード（コード構造から判定）。
+    """
+    rows = []
+    seen = set()
+    items = [
+        (str(c.get("@code", "")), str(c.get("@name", "")))
+        for c in _time_class_list(class_info)
+    ]
+    if extra_codes is not None:
+        items += [(str(c), "") for c in extra_codes]
+    for code, name in items:
+        if code in seen:
+            continue
+        seen.add(code)
+        try:
+            freq, period = parse_time_code(code, name)
+        except ValueError as e:
+            if code not in _WARNED_CODES:
+                _WARNED_CODES.add(code)
+                print(f"[WARN] 時間コード {code} の値は取り込みません: {e}")
+            rows.append((code, name, None, None, None))
+            continue
+        rows.append((code, name, freq, period, period_start_id(freq, period)))
+    dim = pd.DataFrame(rows, columns=TIME_DIM_COLUMNS)
+    return _drop_duplicate_periods(dim.set_index("time_code", drop=False))
+
+
+def _drop_duplicate_periods(dim: pd.DataFrame) -> pd.DataFrame:
+    """
+    先に出たコードと同じ (freq, period) になるコードは取り込まない。
+    同じ (col_key, id) に複数の値が入ると estat_values への pivot が失敗するため。
+    """
+    dup = dim["freq"].notna() & dim.duplicated(["freq", "period"], keep="first")
+    if not dup.any():
+        return dim
+    dim = dim.copy()
+    for code in dim.index[dup]:
+        if code not in _WARNED_CODES:
+            _WARNED_CODES.add(code)
+            print(
+                f"[WARN] 時間コード {code} の値は取り込みません: "
+                f"{dim.at[code, 'freq']} {dim.at[code, 'period']} が他のコードと重複"
+            )
+    dim.loc[dup, ["freq", "period", "id"]] = None
+    return dim
+
+
+def get_time_dim(
+    stats_data_id: str, updated_date: str, class_info: dict
+) -> pd.DataFrame:
+    """statsDataId + UPDATED_DATE ごとに1回だけ time 軸を解析し、プロセス内で使い回す"""
+    key = (str(stats_data_id), str(updated_date))
+    if key not in _TIME_DIM_CACHE:
+        _TIME_DIM_CACHE[key] = build_time_dim(class_info)
+    return _TIME_DIM_CACHE[key]
+
+
+def map_time_codes(codes: pd.Series, dim: pd.DataFrame) -> pd.DataFrame:
+    """
+    time コード列を時間次元表と結合し、(id, freq, period) を返す（ベクトル化）。
+    次元表に無いコードはユニーク値だけコード構造から解析して補う。
+    解釈できないコードの行は id が欠損になる（呼び出し側で除外する）。
+    """
+    codes = codes.astype(str)
+    missing = pd.Index(codes.unique()).difference(dim.index)
+    if len(missing):
+        dim = _drop_duplicate_periods(
+            pd.concat([dim, build_time_dim({}, extra_codes=missing)])
+        )
+    out = dim.reindex(codes.to_numpy())[["id", "freq", "period"]]
+    return out.set_index(codes.index)
+
+
+def save_time_dim(
+    conn: sqlite3.Connection, stats_data_id: str, dim: pd.DataFrame
+) -> None:
+    """時間次元表を estat_time_dim に保存（statsDataId 単位で置き換え）"""
+    conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS {TIME_DIM_TABLE} (
+            stats_data_id TEXT, time_code TEXT, name TEXT, freq TEXT,
+            period INTEGER, id TEXT,
+            PRIMARY KEY (stats_data_id, time_code))"""
+    )
+    conn.execute(
+        f"DELETE FROM {TIME_DIM_TABLE} WHERE stats_data_id = ?", (str(stats_data_id),)
+    )
+    conn.executemany(
+        f"INSERT INTO {TIME_DIM_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (
+                str(stats_data_id),
+                r.time_code,
+                r.name,
+                r.freq,
+                None if pd.isna(r.period) else int(r.period),
+                r.id,
+            )
+            for r in dim.itertuples(index=False)
+        ],
+    )
+    conn.commit()
@@ -1,9 +1,37 @@
 import argparse
+import configparser
+import fnmatch
+import json
 import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
+from sqlalchemy import String, create_engine, text
+
+from estat_hash import (
+    block_hashes,
+    diff_hashes,
+    invalidate_hashes,
+    load_hashes,
+    save_hashes,
+)
+from estat_shared_cache import open_shared_cache
+
+# ---------- 列名ユーティリティ ----------
+
+
+def sanitize_colname(name: str) -> str:
+    """DB列名向けに正規化（英数字・かな漢字・_ 以外を _ に置換）"""
+    return re.sub(r"[^\w]", "_", str(name))
+
+
+def quote_ident_sqlite(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
 
 # ---------- 分類 & ワイド化 ----------
 
@@ -24,10 +52,13 @@ def classify_monthly_deviation_wide(
     uppercase: bool = False,
     sort_by_date: str = "asc",  # 'asc' | 'desc' | 'none'
     id_dedupe: str = "none",  # 'none' | 'first' | 'last' | 'mean'
+    id_format: str = "%Y%m%d",
+    baseline: Optional[Tuple[str, str]] = None,
 ) -> Tuple[pd.DataFrame, Dict[str, str]]:
     """
     複数の値列について、列×月ごとに 月平均との差 をσベース(a〜e)で分類し、
     最終出力をワイド形式（id + 各列クラス）で返す。
+    baseline=(開始id, 終了id) 指定時は、その期間だけで月平均・標準偏差を求める。
     戻り値: (wide_df, colmap {元の列名: 正規化後の列名})
     """
     data = df.copy()
@@ -49,7 +80,7 @@ def classify_monthly_deviation_wide(
             data = data.groupby(id_col, as_index=False).agg(agg_map)
 
     # 月抽出
-    dt = pd.to_datetime(data[id_col], format="%Y%m%d", errors="coerce")
+    dt = pd.to_datetime(data[id_col], format=id_format, errors="coerce")
     data["month"] = dt.dt.month
 
     # 対象列
@@ -67,9 +98,19 @@ def classify_monthly_deviation_wide(
     )
 
     # 月平均・標準偏差（列×月）
-    grp = long.groupby(["元の列名", "month"])["元の値"]
-    long["MONTHLY_AVE"] = grp.transform("mean")
-    long["MONTHLY_STD"] = grp.transform("std")
+    if baseline is None:
+        grp = long.groupby(["元の列名", "month"])["元の値"]
+        long["MONTHLY_AVE"] = grp.transform("mean")
+        long["MONTHLY_STD"] = grp.transform("std")
+    else:
+        long_dt = pd.to_datetime(long[id_col], format=id_format, errors="coerce")
+        b_from, b_to = (pd.to_datetime(b, format=id_format) for b in baseline)
+        stats = (
+            long[long_dt.between(b_from, b_to)]
+            .groupby(["元の列名", "month"])["元の値"]
+            .agg(MONTHLY_AVE="mean", MONTHLY_STD="std")
+        )
+        long = long.join(stats, on=["元の列名", "month"])
 
     # 偏差・z
     long["偏差"] = long["元の値"] - long["MONTHLY_AVE"]
@@ -81,9 +122,9 @@ def classify_monthly_deviation_wide(
     # 標準偏差が出ないケースのフォールバック
     tol = 1e-12
     mask_nan = cls.isna()
-    cls[mask_nan & (long["偏差"].abs() <= tol)] = "c"
-    cls[mask_nan & (long["偏差"] > tol)] = "a"
-    cls[mask_nan & (long["偏差"] < -tol)] = "e"
+    cls[mask_nan & (long["偏差"].abs() <= tol)] = labels[len(labels) // 2]
+    cls[mask_nan & (long["偏差"] > tol)] = labels[-1]
+    cls[mask_nan & (long["偏差"] < -tol)] = labels[0]
 
     if uppercase:
         cls = cls.str.upper()
@@ -106,7 +147,7 @@ def classify_monthly_deviation_wide(
     # 時系列で並べ替え
     if sort_by_date in ("asc", "desc"):
         sort_key = pd.to_datetime(
-            wide[colmap[id_col]].astype(str), format="%Y%m%d", errors="coerce"
+            wide[colmap[id_col]].astype(str), format=id_format, errors="coerce"
         )
         wide = (
             wide.assign(_sort_key=sort_key)
@@ -128,11 +169,32 @@ def write_sqlite_adj_table(
     id_col: str = "id",
     mode: str = "upsert",  # 'upsert' | 'replace'
     chunksize: Optional[int] = None,
-) -> None:
+    skip_unchanged: bool = True,
+) -> int:
     """
     ワイドDataFrame（id + 各列クラス）を SQLite に保存。
     既定: "adj-table" に UPSERT（INSERT OR REPLACE）。
+    skip_unchanged: (列, 年) ごとの内容ハッシュが前回と同じブロックは書き込まない。
+    戻り値: スキップしたブロック数
     """
+    skipped = 0
+    if skip_unchanged:
+        long = wide.melt(id_vars=id_col, var_name="col_key", value_name="value")
+        hashes = block_hashes(long, id_col=id_col)
+        with sqlite3.connect(sqlite_path) as hconn:
+            changed, skipped = diff_hashes(hashes, load_hashes(hconn, table))
+        if changed.empty:
+            return skipped
+        if mode == "upsert":
+            # 変わった年の行だけ書く（行は id 単位なので年で絞る）
+            years = set(changed.loc[changed["year"] != 0, "year"])
+            row_year = (
+                pd.to_numeric(wide[id_col].astype(str).str[:4], errors="coerce")
+                .fillna(-1)
+                .astype(int)
+            )
+            wide = wide[row_year.isin(years)]
+
     engine = create_engine(f"sqlite:///{sqlite_path}", future=True)
 
     # ステージ表は安全名で作成（- を含めない）
@@ -178,7 +240,7 @@ def write_sqlite_adj_table(
 
         # INSERT OR REPLACE で UPSERT（mode=replace でも同じ式で可）
         insert_cols = ", ".join([quote_ident_sqlite(c) for c in cols])
-        select_cols = ", ".join([f"s.{c}" for c in cols])
+        select_cols = ", ".join([f"s.{quote_ident_sqlite(c)}" for c in cols])
         merge_sql = f"""
         INSERT OR REPLACE INTO {tgt} ({insert_cols})
         SELECT {select_cols} FROM {stage} s;
@@ -188,6 +250,197 @@ def write_sqlite_adj_table(
         # ステージ表を削除
         conn.execute(text(f"DROP TABLE IF EXISTS {stage};"))
 
+    if skip_unchanged:
+        with sqlite3.connect(sqlite_path) as hconn:
+            if mode == "replace":
+                invalidate_hashes(hconn, table)
+                save_hashes(hconn, table, hashes)
+            else:
+                save_hashes(hconn, table, changed)
+    return skipped
+
+
+# ---------- バッチ（複数 adj-table の一括作成） ----------
+
+RUN_META_TABLE = "adj_run_meta"
+
+DEFAULT_BINS = "-inf, -1.0, -0.3, 0.3, 1.0, inf"
+DEFAULT_LABELS = "e, d, c, b, a"
+
+
+def _split_list(value: str) -> List[str]:
+    return [v for v in re.split(r"[,\s]+", value or "") if v]
+
+
+def load_batch_config(path: str) -> List[dict]:
+    """
+    バッチ設定（INI）を読み込み、ビルドごとの設定 dict のリストを返す。
+    [DEFAULT] は全ビルド共通の既定値、それ以外の各セクションが1つのビルド。
+
+        [DEFAULT]
+        id_format = %Y%m%d
+
+        [watcher_di]
+        series = tab-140_*            ; estat_values の列（fnmatch パターン可）
+        bins = -inf, -1.5, -0.5, 0.5, 1.5, inf
+        labels = e, d, c, b, a
+        baseline = 20150101, 20191231 ; 月平均・σ を求める期間（省略時は全期間）
+        table = adj-watcher
+
+        [orders_csv]
+        input_csv = ./orders.csv
+        table = adj-orders
+    """
+    cp = configparser.ConfigParser(
+        interpolation=None, inline_comment_prefixes=(";", "#")
+    )
+    cp.read(path, encoding="utf-8")
+    builds = []
+    for name in cp.sections():
+        sec = cp[name]
+        bins = tuple(float(b) for b in _split_list(sec.get("bins", DEFAULT_BINS)))
+        labels = tuple(_split_list(sec.get("labels", DEFAULT_LABELS)))
+        if len(bins) != len(labels) + 1:
+            raise ValueError(f"[{name}] bins は labels より1つ多く指定してください。")
+        baseline = _split_list(sec.get("baseline", ""))
+        if baseline and len(baseline) != 2:
+            raise ValueError(
+                f"[{name}] baseline は「開始id, 終了id」の2つを指定してください: {baseline}"
+            )
+        builds.append(
+            {
+                "name": name,
+                "input_csv": sec.get("input_csv"),
+                "series": _split_list(sec.get("series", "")),
+                "id_col": sec.get("id_col", "id"),
+                "value_cols": _split_list(sec.get("value_cols", "")) or None,
+                "bins": bins,
+                "labels": labels,
+                "baseline": tuple(baseline) if baseline else None,
+                "id_format": sec.get("id_format", "%Y%m%d"),
+                "uppercase": sec.getboolean("uppercase", False),
+                "sort_by_date": sec.get("sort_by_date", "asc"),
+                "id_dedupe": sec.get("id_dedupe", "none"),
+                "table": sec.get("table", f"adj-{name}"),
+                "mode": sec.get("mode", "upsert"),
+            }
+        )
+    return builds
+
+
+def _build_input(build: dict, values: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """ビルドの入力（CSV または estat_values の系列グループ）"""
+    if build["input_csv"]:
+        return pd.read_csv(build["input_csv"])
+    cols = [
+        c
+        for c in values.columns
+        if c != "id" and any(fnmatch.fnmatchcase(c, pat) for pat in build["series"])
+    ]
+    if not cols:
+        raise ValueError(f"[{build['name']}] series に一致する列がありません。")
+    return values[["id"] + cols]
+
+
+def _record_run(sqlite_path: str, meta: dict) -> None:
+    with sqlite3.connect(sqlite_path) as conn:
+        conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS {RUN_META_TABLE} (
+                run_id TEXT, build TEXT, tbl TEXT, source TEXT, bins TEXT,
+                labels TEXT, baseline TEXT, id_format TEXT, mode TEXT,
+                n_rows INTEGER, n_cols INTEGER, skipped_blocks INTEGER,
+                elapsed_sec REAL, finished_at TEXT)"""
+        )
+        conn.execute(
+            f"INSERT INTO {RUN_META_TABLE} VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now', 'localtime'))",
+            (
+                meta["run_id"],
+                meta["build"],
+                meta["table"],
+                meta["source"],
+                json.dumps(meta["bins"]),
+                json.dumps(meta["labels"], ensure_ascii=False),
+                json.dumps(meta["baseline"]),
+                meta["id_format"],
+                meta["mode"],
+                meta["rows"],
+                meta["cols"],
+                meta["skipped"],
+                meta["elapsed_sec"],
+            ),
+        )
+
+
+def run_batch(
+    config_path: str,
+    sqlite_path: str,
+    max_workers: int = 4,
+    chunksize: Optional[int] = None,
+    skip_unchanged: bool = True,
+) -> List[dict]:
+    """
+    バッチ設定の全ビルドを1プロセスで実行する。
+    - estat_values は共有キャッシュ（memmap）から1回だけ読み、全ビルドで共用
+    - 分類は max_workers 本のスレッドで並行実行
+    - DB書き込みは単一のライタースレッドに直列化し、ビルドごとに adj_run_meta へ記録
+    戻り値: ビルドごとの実行メタ情報
+    """
+    builds = load_batch_config(config_path)
+    values = None
+    if any(not b["input_csv"] for b in builds):
+        values = open_shared_cache(sqlite_path).frame().reset_index()
+    run_id = time.strftime("%Y%m%d%H%M%S")
+
+    def write(build: dict, wide: pd.DataFrame, colmap: Dict[str, str], t0: float):
+        skipped = write_sqlite_adj_table(
+            wide=wide,
+            sqlite_path=sqlite_path,
+            table=build["table"],
+            id_col=colmap.get(build["id_col"], build["id_col"]),
+            mode=build["mode"],
+            chunksize=chunksize,
+            skip_unchanged=skip_unchanged,
+        )
+        meta = {
+            "run_id": run_id,
+            "build": build["name"],
+            "table": build["table"],
+            "source": build["input_csv"] or ",".join(build["series"]),
+            "bins": [str(b) for b in build["bins"]],
+            "labels": list(build["labels"]),
+            "baseline": build["baseline"],
+            "id_format": build["id_format"],
+            "mode": build["mode"],
+            "rows": len(wide),
+            "cols": len(wide.columns),
+            "skipped": skipped,
+            "elapsed_sec": time.perf_counter() - t0,
+        }
+        _record_run(sqlite_path, meta)
+        return meta
+
+    def classify(build: dict):
+        t0 = time.perf_counter()
+        wide, colmap = classify_monthly_deviation_wide(
+            df=_build_input(build, values),
+            id_col=build["id_col"],
+            value_cols=build["value_cols"],
+            bins=build["bins"],
+            labels=build["labels"],
+            uppercase=build["uppercase"],
+            sort_by_date=build["sort_by_date"],
+            id_dedupe=build["id_dedupe"],
+            id_format=build["id_format"],
+            baseline=build["baseline"],
+        )
+        return writer.submit(write, build, wide, colmap, t0)
+
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            write_futures = [f.result() for f in [pool.submit(classify, b) for b in builds]]
+        return [f.result() for f in write_futures]
+
 
 # ---------- CLI & メイン ----------
 
@@ -200,9 +453,16 @@ def parse_args() -> argparse.Namespace:
     p.add_argument(
         "--input-csv",
         type=str,
-        required=True,
         help="入力CSVのパス（id と 複数の値列を含む）",
     )
+    p.add_argument(
+        "--batch-config",
+        type=str,
+        help="バッチ設定INI（複数の adj-table を1プロセスで作成。load_batch_config 参照）",
+    )
+    p.add_argument(
+        "--workers", type=int, default=4, help="バッチ時の分類の並列数"
+    )
     p.add_argument("--id-col", type=str, default="id", help="id列名（YYYYMMDD想定）")
     p.add_argument(
         "--value-cols", nargs="*", help="対象の値列名（省略時は自動検出: 数値列）"
@@ -247,12 +507,35 @@ def parse_args() -> argparse.Namespace:
     p.add_argument(
         "--chunksize", type=int, default=None, help="DB書き込みチャンクサイズ"
     )
-    return p.parse_args()
+    p.add_argument(
+        "--no-skip-unchanged",
+        action="store_true",
+        help="内容ハッシュが前回と同じブロックも書き込む",
+    )
+    args = p.parse_args()
+    if not args.input_csv and not args.batch_config:
+        p.error("--input-csv または --batch-config のどちらかを指定してください。")
+    return args
 
 
 def main():
     args = parse_args()
 
+    if args.batch_config:
+        runs = run_batch(
+            args.batch_config,
+            args.sqlite,
+            max_workers=args.workers,
+            chunksize=args.chunksize,
+            skip_unchanged=not args.no_skip_unchanged,
+        )
+        for r in runs:
+            print(
+                f"[DONE] {r['build']}: テーブル {r['table']!r}"
+                f" rows={r['rows']}, cols={r['cols']}, skipped_blocks={r['skipped']}"
+            )
+        return
+
     # 1) 入力CSV
     df = pd.read_csv(args.input_csv)
 
@@ -267,18 +550,19 @@ def main():
     )
 
     # 3) SQLite へ保存（"adj-table"）
-    write_sqlite_adj_table(
+    skipped = write_sqlite_adj_table(
         wide=wide,
         sqlite_path=args.sqlite,
         table=args.table,
         id_col=colmap.get(args.id_col, args.id_col),
         mode=args.mode,
         chunksize=args.chunksize,
+        skip_unchanged=not args.no_skip_unchanged,
     )
 
     print(
         f"[DONE] SQLite '{args.sqlite}' のテーブル {args.table!r} を更新しました。"
-        f" rows={len(wide)}, cols={len(wide.columns)}"
+        f" rows={len(wide)}, cols={len(wide.columns)}, skipped_blocks={skipped}"
     )
 
 
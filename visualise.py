@@ -1,13 +1,16 @@
 import re
-import sqlite3
 import pandas as pd
 
+from estat_shared_cache import open_shared_cache
+
 DB = "estat_data.db"
 
 # 1) 本体とメタ情報の読み込み
-with sqlite3.connect(DB) as conn:
-    df = pd.read_sql_query("SELECT * FROM estat_values", conn)
-    meta = pd.read_sql_query("SELECT * FROM estat_column_meta", conn)
+# 共有キャッシュ（memmap）経由。DB の取り込み世代が進んでいれば作り直す。
+# df は id を index に持ち、値は他プロセスと共有するページキャッシュを参照する。
+cache = open_shared_cache(DB)
+df = cache.frame()
+meta = cache.meta
 
 
 # 2) テーブル名（統計表タイトル）の取得